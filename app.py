@@ -1,5 +1,4 @@
-from app import app
-
-
 if __name__ == '__main__':
-    app.run()
\ No newline at end of file
+    # Imported here: the bcrypt pool's spawn workers re-run this script and must not build the app
+    from app import app
+    app.run()
@@ -1,5 +1,4 @@
 from flask import Flask
-from flask_bcrypt import Bcrypt
 from flask_restx import Api
 from flask_sqlalchemy import SQLAlchemy
 from config import Config
@@ -8,11 +7,21 @@ from config import Config
 app = Flask(__name__)
 """导入配置"""
 app.config.from_object(Config)
-"""初始化SQLAlchemy"""
-db = SQLAlchemy(app)
-bcrypt = Bcrypt(app)
+"""初始化SQLAlchemy，GET请求的读操作路由到只读副本（如已配置）"""
+from app.replicas import RoutingSession, init_replicas
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+init_replicas(app, db)
 """初始化Restx"""
 api = Api(app, version='1.0', title='Flask-sqlalchemy API', description='Flask-sqlalchemy project API')
+"""JSON编码（orjson）与响应压缩（gzip/brotli），需在计时之前注册"""
+from app.encoding import init_encoding
+init_encoding(app, api)
+"""统计每个请求的SQL语句数量与耗时（SQL、处理、JSON编码）"""
+from app.query_log import init_query_log
+init_query_log(app, api)
+"""Prometheus指标：/metrics"""
+from app.metrics import init_metrics
+init_metrics(app, api)
 
 """使用namesapce继续对url进行分类扩展。127.0.0.1:5000/api/v1/users"""
 user_api = api.namespace("api/v1/users", description='User operation')
@@ -27,6 +36,8 @@ review_api = api.namespace('api/v1/review', description='review operations')
 
 place_api = api.namespace('api/v1/place', description='place operations')
 
+cache_api = api.namespace('api/v1/cache', description='cache statistics')
+
 from app.user_api import *
 
 from app.country_api import *
@@ -37,4 +48,8 @@ from app.amenity_api import *
 
 from app.place_api import *
 
-from app.review_api import *
\ No newline at end of file
+from app.review_api import *
+
+from app.cache_api import *
+
+from app import commands
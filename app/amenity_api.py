@@ -3,10 +3,13 @@ from datetime import datetime
 
 from flask import request
 from flask_restx import Resource, fields
+from sqlalchemy.exc import IntegrityError
 
 from app import amenity_api, db
 from config import Config
 from models.amenity import Amenity
+from app.pagination import paginate, default_keys
+from app.serializers import amenity_to_dict
 
 """Define the Amenity model for the API documentation"""
 amenity_model = amenity_api.model('Amenity', {
@@ -20,18 +23,12 @@ amenity_model = amenity_api.model('Amenity', {
 class AmenityList(Resource):
     @amenity_api.doc("get all amenities")
     def get(self):
-        """Query all amenities from the database"""
-        amenities = Amenity.query.filter_by(is_deleted=0).all()
-        result = []
-        """Convert each Amenity object to a dictionary"""
-        for amenity in amenities:
-            result.append({
-                "id": amenity.id,
-                "name": amenity.name,
-                "created_at": amenity.created_at.strftime(Config.datetime_format),
-                "updated_at": amenity.updated_at.strftime(Config.datetime_format)
-            })
-        return result
+        """Query one page of amenities from the database"""
+        query = Amenity.query
+        amenities, next_cursor = paginate(amenity_api, query, default_keys(Amenity),
+                                          versions=query.with_entities(Amenity.updated_at))
+        result = [amenity_to_dict(amenity) for amenity in amenities]
+        return {"results": result, "next_cursor": next_cursor}
 
     @amenity_api.doc('create a new amenity')
     def post(self):
@@ -41,20 +38,24 @@ class AmenityList(Resource):
         if not data.get('name'):
             amenity_api.abort(400, message='Invalid input')
 
-        new_amenity = Amenity(name=data['name'])
-        db.session.add(new_amenity)
-        db.session.commit()
+        # Two amenities created at once can pick the same mask bit; the unique index makes one of them retry
+        for attempt in range(3):
+            new_amenity = Amenity(name=data['name'])
+            new_amenity.bit = Amenity.next_bit()
+            db.session.add(new_amenity)
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                db.session.rollback()
+        else:
+            amenity_api.abort(409, message='Could not create the amenity, try again')
 
-        return {
-            "id": new_amenity.id,
-            "name": new_amenity.name,
-            "created_at": new_amenity.created_at.strftime(Config.datetime_format),
-            "updated_at": new_amenity.updated_at.strftime(Config.datetime_format)
-        }
+        return amenity_to_dict(new_amenity)
 
     @amenity_api.doc('delete_amenity')
     def delete(self, amenity_id):
-        amenity = Amenity.query.filter_by(id=amenity_id, is_deleted=0).first()
+        amenity = Amenity.query.filter_by(id=amenity_id).first()
         if amenity is None:
             return amenity_api.abort(404, 'User not found')
         try:
@@ -0,0 +1,72 @@
+"""``?amenities=<id>,<id>&amenity_match=all|any`` on the place listings.
+
+Every amenity gets a bit of ``places.amenity_mask`` when it is created
+(``Amenity.bit``), and attaching or detaching an amenity sets or clears that
+bit in the same transaction as the ``place_amenities`` row. "Places with
+wifi and parking" is then ``amenity_mask & mask = mask`` ("any" is
+``<> 0``), one test per row instead of a join per amenity. Amenities
+created after the MASK_BITS bits ran out have no bit and are matched with
+an EXISTS on place_amenities instead.
+"""
+from flask import request
+from sqlalchemy import and_, exists, or_, select
+
+from app import db
+from app.ids import format_id, parse_id
+from models.amenity import Amenity
+from models.place import Place, place_amenities
+
+MATCHES = ('all', 'any')
+
+
+def parse_amenity_filter(args):
+    """``(amenity_ids, match)`` from the query string; ValueError with the message for the client"""
+    match = args.get('amenity_match', 'all')
+    if match not in MATCHES:
+        raise ValueError('amenity_match must be one of {}'.format(', '.join(MATCHES)))
+    ids = []
+    for value in args.get('amenities', '').split(','):
+        value = value.strip()
+        if not value:
+            continue
+        raw = parse_id(value)
+        if raw is None:
+            raise ValueError('Unknown amenity: {}'.format(value))
+        ids.append(format_id(raw))
+    return ids, match
+
+
+def amenity_bits(ids):
+    """Query of ``(id, bit)`` for the live amenities among ``ids``"""
+    return select(Amenity.id, Amenity.bit).where(Amenity.id.in_(ids))
+
+
+def amenity_criterion(ids, match, bits):
+    """WHERE clause for places with all (or any) of ``ids``; ``bits`` is the ``amenity_bits`` result as a dict"""
+    mask = 0
+    unindexed = []
+    for amenity_id in ids:
+        if amenity_id not in bits:
+            raise ValueError('Unknown amenity: {}'.format(amenity_id))
+        if bits[amenity_id] is None:
+            unindexed.append(exists().where(place_amenities.c.place_id == Place.id,
+                                            place_amenities.c.amenity_id == amenity_id))
+        else:
+            mask |= 1 << bits[amenity_id]
+
+    if match == 'all':
+        masked = [Place.amenity_mask.bitwise_and(mask) == mask] if mask else []
+        return and_(*masked, *unindexed)
+    masked = [Place.amenity_mask.bitwise_and(mask) != 0] if mask else []
+    return or_(*masked, *unindexed)
+
+
+def amenity_filter(namespace):
+    """The criterion for this request's ``?amenities=``, or None when the listing is not filtered"""
+    try:
+        ids, match = parse_amenity_filter(request.args)
+        if not ids:
+            return None
+        return amenity_criterion(ids, match, dict(db.session.execute(amenity_bits(ids)).all()))
+    except ValueError as e:
+        namespace.abort(400, message=str(e))
@@ -0,0 +1,268 @@
+"""Asyncio versions of the read endpoints of places, reviews and cities.
+
+``asgi.py`` runs these on the event loop with an async SQLAlchemy engine, so
+a request waiting on the database holds a coroutine instead of a thread;
+every other request is handed to the Flask app. The handlers are built from
+the same pieces as the Flask resources (keyset pagination, sparse fieldsets,
+conditional GET validators, the country/city snapshot, the soft-delete criteria),
+so bodies, ETags and error messages are identical in both serving modes.
+Reads are routed to the replicas like in ``app.replicas``.
+"""
+from urllib.parse import parse_qsl
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from werkzeug.datastructures import MIMEAccept, MultiDict
+from werkzeug.http import http_date, parse_accept_header, parse_cookie, parse_date, parse_etags, quote_etag
+
+from app import metrics
+from app.amenity_filter import amenity_bits, amenity_criterion, parse_amenity_filter
+from app.city_api import CityById, CityList, CountryCities, city_versions
+from app.conditional import http_last_modified, is_fresh, make_validators, page_summary, page_validators
+from app.encoding import compress, dumps, negotiate, should_compress
+from app.fieldsets import parse_fieldset, resolve_fieldset
+from app.pagination import default_keys, keyset, parse_limit, split_page
+from app.parents import city_parents, place_parents, review_parents
+from app.reference import reference_index
+from app.replicas import choose_bind, make_read_only
+from app.place_api import PlaceById, PlaceList, PlaceReviews, place_versions
+from app.review_api import ReviewById, ReviewList, review_versions
+from app.serializers import city_with_country_code, place_detail, review_detail, review_with_user, \
+    sparse_serializer
+from app.streaming import NDJSON
+from config import Config, async_database_uri, engine_options
+from models.city import City
+from models.place import Place
+from models.review import Review
+
+engine = create_async_engine(Config.ASYNC_DATABASE_URI, **engine_options(Config.ASYNC_DATABASE_URI))
+Session = async_sessionmaker(engine, expire_on_commit=False)
+replica_engines = {}
+for key, options in Config.SQLALCHEMY_BINDS.items():
+    options = dict(options)
+    uri = async_database_uri(options.pop('url'))
+    replica_engines[key] = create_async_engine(uri, **options)
+    make_read_only(replica_engines[key].sync_engine)
+
+
+class HTTPError(Exception):
+    """Answer with ``code`` and ``{"message": message}``, like ``Namespace.abort``"""
+
+    def __init__(self, code, message=None):
+        super(HTTPError, self).__init__(message)
+        self.code = code
+        self.message = message
+
+
+class Request(object):
+    """The parts of an ASGI HTTP request the handlers read"""
+
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.path = scope['path']
+        query_string = scope['query_string'].decode('latin-1')
+        # Same layout as werkzeug's request.full_path, which the ETags are derived from
+        self.full_path = '%s?%s' % (self.path, query_string)
+        self.args = MultiDict(parse_qsl(query_string, keep_blank_values=True))
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        self.if_none_match = parse_etags(self.headers.get('if-none-match'))
+        self.if_modified_since = parse_date(self.headers.get('if-modified-since'))
+        self.accept_encodings = parse_accept_header(self.headers.get('accept-encoding'))
+        self.cookies = parse_cookie(self.headers.get('cookie'))
+        # Validators added to the response by check()
+        self.validators = []
+
+    def wants_stream(self):
+        """``streaming.wants_stream`` for this request"""
+        if self.args.get('stream') == '1':
+            return True
+        accept = parse_accept_header(self.headers.get('accept'), MIMEAccept)
+        return accept.best_match(['application/json', NDJSON]) == NDJSON
+
+
+def check(request, etag, last_modified):
+    """``conditional.check``: raise a 304 if the client's copy is current, else keep the validators"""
+    last_modified = http_last_modified(last_modified)
+    request.validators = [('ETag', quote_etag(etag))]
+    if last_modified is not None:
+        request.validators.append(('Last-Modified', http_date(last_modified)))
+    if is_fresh(etag, last_modified, request.if_none_match, request.if_modified_since):
+        raise HTTPError(304)
+
+
+def fieldset(request, serializer, keys=()):
+    try:
+        requested = parse_fieldset(request.args, serializer)
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+    return resolve_fieldset(requested, serializer, keys)
+
+
+async def paginate(session, request, query, keys, versions=None):
+    """``pagination.paginate`` on an AsyncSession"""
+    try:
+        limit = parse_limit(request.args.get('limit', Config.PAGE_SIZE_DEFAULT))
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+    cursor = request.args.get('cursor')
+    try:
+        page = keyset(query, keys, limit, cursor)
+    except ValueError:
+        raise HTTPError(400, 'Invalid cursor')
+    if versions is not None:
+        row = (await session.execute(page_summary(keyset(versions, keys, limit, cursor), keys))).one()
+        check(request, *page_validators(request.full_path, row, keys))
+    rows = (await session.execute(page)).scalars().all()
+    return split_page(rows, keys, limit)
+
+
+async def first(session, query):
+    return (await session.execute(query)).scalars().first()
+
+
+async def place_list(session, request):
+    serialize, options = fieldset(request, place_detail, default_keys(Place))
+    query, versions = place_parents(select(Place)).options(*options), place_versions()
+    try:
+        ids, match = parse_amenity_filter(request.args)
+        if ids:
+            criterion = amenity_criterion(ids, match, dict((await session.execute(amenity_bits(ids))).all()))
+            query, versions = query.where(criterion), versions.where(criterion)
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+    places, next_cursor = await paginate(session, request, query, default_keys(Place), versions=versions)
+    return {"results": [serialize(place) for place in places], "next_cursor": next_cursor}
+
+
+async def place_by_id(session, request, place_id):
+    version = (await session.execute(place_versions().where(Place.id == place_id))).first()
+    if version is None:
+        raise HTTPError(404, 'Place not found!')
+    check(request, *make_validators(request.full_path, version))
+
+    serialize, options = fieldset(request, place_detail)
+    place = await first(session, place_parents(select(Place)).options(*options).where(Place.id == place_id))
+    if place is None:
+        raise HTTPError(404, 'Place not found!')
+    return serialize(place)
+
+
+async def place_reviews(session, request, place_id):
+    serialize, options = fieldset(request, review_with_user)
+    if (await session.execute(select(Place.id).where(Place.id == place_id))).first() is None:
+        raise HTTPError(404, 'Place not found')
+
+    reviews = (await session.execute(review_parents(select(Review)).options(*options).where(Review.place_id == place_id)
+                                     .order_by(Review.created_at, Review.id))).scalars().all()
+    return [serialize(review) for review in reviews]
+
+
+async def review_list(session, request):
+    serialize, options = fieldset(request, review_detail, default_keys(Review))
+    reviews, next_cursor = await paginate(session, request, review_parents(select(Review)).options(*options),
+                                          default_keys(Review), versions=review_versions())
+    return {"results": [serialize(review) for review in reviews], "next_cursor": next_cursor}
+
+
+async def review_by_id(session, request, review_id):
+    serialize, options = fieldset(request, review_detail)
+    review = await first(session, review_parents(select(Review)).options(*options).where(Review.id == review_id))
+    if review is None:
+        raise HTTPError(404, 'Review not found')
+    return serialize(review)
+
+
+async def city_list(session, request):
+    try:
+        requested = parse_fieldset(request.args, city_with_country_code)
+        limit = parse_limit(request.args.get('limit', Config.PAGE_SIZE_DEFAULT))
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+    serialize = sparse_serializer(city_with_country_code, *requested)
+    try:
+        cities, next_cursor = reference_index.current().city_page(limit, request.args.get('cursor'))
+    except ValueError:
+        raise HTTPError(400, 'Invalid cursor')
+
+    versions = [city.updated_at for city in cities] + [city.country.updated_at for city in cities]
+    check(request, *make_validators(request.full_path, versions, len(cities), next_cursor))
+    return {"results": [serialize(city) for city in cities], "next_cursor": next_cursor}
+
+
+async def city_by_id(session, request, city_id):
+    version = (await session.execute(city_versions().where(City.id == city_id))).first()
+    if version is None:
+        raise HTTPError(404, 'City not found!')
+    check(request, *make_validators(request.full_path, version))
+
+    serialize, options = fieldset(request, city_with_country_code)
+    city = await first(session, city_parents(select(City)).options(*options).where(City.id == city_id))
+    if city is None:
+        raise HTTPError(404, 'City not found!')
+    return serialize(city)
+
+
+async def country_cities(session, request, country_code):
+    try:
+        requested = parse_fieldset(request.args, city_with_country_code)
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+    serialize = sparse_serializer(city_with_country_code, *requested)
+    result = reference_index.current().country_cities(country_code, serialize)
+    if result is None:
+        raise HTTPError(404, 'Country not found')
+    return result
+
+
+# Flask resource whose GET each handler replaces
+HANDLERS = {
+    PlaceList: place_list,
+    PlaceById: place_by_id,
+    PlaceReviews: place_reviews,
+    ReviewList: review_list,
+    ReviewById: review_by_id,
+    CityList: city_list,
+    CityById: city_by_id,
+    CountryCities: country_cities,
+}
+
+
+def endpoints(app):
+    """Map the Flask endpoint names of the resources in ``HANDLERS`` to their handlers"""
+    found = {}
+    for endpoint, view in app.view_functions.items():
+        handler = HANDLERS.get(getattr(view, 'view_class', None))
+        if handler is not None:
+            found[endpoint] = handler
+    return found
+
+
+async def serve(endpoint, handler, request, view_args):
+    """Run ``handler`` in its own session and return ``(status, headers, body)`` for the ASGI response"""
+    started = metrics.request_started() if Config.METRICS_ENABLED else None
+    # Anything other than an HTTPError escapes to the server, which answers 500
+    status = 500
+    try:
+        replica = choose_bind(request.method, request.cookies)
+        async with Session(bind=replica_engines[replica] if replica is not None else engine) as session:
+            status, result = 200, await handler(session, request, **view_args)
+    except HTTPError as e:
+        status, result = e.code, {"message": e.message}
+    finally:
+        if started is not None:
+            metrics.request_finished(endpoint, request.method, status, started)
+    headers = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in request.validators]
+    if status == 304:
+        return status, headers, b''
+    body = dumps(result)
+    headers.append((b'content-type', b'application/json'))
+    if should_compress(len(body)):
+        headers.append((b'vary', b'Accept-Encoding'))
+        encoding = negotiate(request.accept_encodings)
+        if encoding is not None:
+            body = compress(body, encoding)
+            # Same rule as encoding.compress_response: a compressed body gets a weak ETag
+            headers = [(name, b'W/' + value if name == b'etag' else value) for name, value in headers]
+            headers.append((b'content-encoding', encoding.encode('latin-1')))
+    headers.append((b'content-length', str(len(body)).encode('latin-1')))
+    return status, headers, body
@@ -0,0 +1,120 @@
+"""Helpers shared by the ``/bulk`` create endpoints.
+
+A bulk request is handled in set-based steps instead of once per item:
+
+1. every item is validated in Python and gets its own result slot;
+2. foreign keys are checked with one ``IN`` query per key column;
+3. the surviving rows are inserted with a batched executemany and committed
+   every ``Config.BULK_CHUNK_SIZE`` rows.
+
+If a chunk fails to commit it is retried row by row, so one bad row only
+fails itself.
+"""
+from flask import request
+
+from app import db
+from app.ids import BinaryUUID, format_id, parse_id
+from config import Config
+
+IN_CLAUSE_SIZE = 1000
+
+
+class BulkResult(object):
+    """Per-item outcome of a bulk request, in request order"""
+
+    def __init__(self, size):
+        self.results = [None] * size
+
+    def ok(self, index, id):
+        self.results[index] = {"index": index, "status": 201, "id": id}
+
+    def fail(self, index, status, message):
+        self.results[index] = {"index": index, "status": status, "message": message}
+
+    def failed(self, index):
+        return self.results[index] is not None and self.results[index]["status"] != 201
+
+    def response(self):
+        created = sum(1 for result in self.results if result and result["status"] == 201)
+        body = {"created": created, "failed": len(self.results) - created, "results": self.results}
+        return body, 201 if created == len(self.results) else 207
+
+
+def bulk_items(namespace):
+    """Read the JSON array of items to create, aborting with 400 if it is unusable"""
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not items:
+        namespace.abort(400, message='Expected a non-empty JSON array')
+    if len(items) > Config.BULK_MAX_ITEMS:
+        namespace.abort(400, message='At most {} items per request'.format(Config.BULK_MAX_ITEMS))
+    return items
+
+
+def existing_values(column, values, *criteria, include_deleted=False):
+    """Return which of ``values`` exist in ``column`` (one IN query per 1000 values).
+
+    Soft-deleted rows are skipped unless ``include_deleted`` is set. Ids
+    are compared in their canonical form, so an upper-case or braced UUID
+    matches its row; the values returned are the ones given.
+    """
+    given = {}
+    for value in values:
+        given.setdefault(canonical(column, value), []).append(value)
+    keys = [key for key in given if key is not None]
+    found = set()
+    for start in range(0, len(keys), IN_CLAUSE_SIZE):
+        chunk = keys[start:start + IN_CLAUSE_SIZE]
+        rows = db.session.query(column).filter(column.in_(chunk), *criteria) \
+            .execution_options(include_deleted=include_deleted).all()
+        for row in rows:
+            found.update(given.get(row[0], ()))
+    return found
+
+
+def canonical(column, value):
+    """``value`` as ``column`` returns it: the canonical string for id columns, None if it is not an id"""
+    if not isinstance(column.type, BinaryUUID):
+        return value
+    raw = parse_id(value)
+    return format_id(raw) if raw is not None else None
+
+
+def row_values(obj):
+    """Column values set on a transient model object, ready for a Core insert"""
+    state = obj.__dict__
+    return {column.key: state[column.key] for column in obj.__table__.columns if column.key in state}
+
+
+def insert_chunks(model, pending, result, after_chunk=None):
+    """Insert ``pending`` ``(index, obj)`` pairs in committed chunks.
+
+    ``after_chunk(objects)`` runs inside each chunk's transaction, e.g. to
+    update aggregates for the rows just inserted.
+    """
+    insert = model.__table__.insert()
+    for start in range(0, len(pending), Config.BULK_CHUNK_SIZE):
+        chunk = pending[start:start + Config.BULK_CHUNK_SIZE]
+        try:
+            db.session.execute(insert, [row_values(obj) for _, obj in chunk])
+            if after_chunk is not None:
+                after_chunk([obj for _, obj in chunk])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            _insert_one_by_one(insert, chunk, result, after_chunk)
+            continue
+        for index, obj in chunk:
+            result.ok(index, obj.id)
+
+
+def _insert_one_by_one(insert, chunk, result, after_chunk):
+    for index, obj in chunk:
+        try:
+            db.session.execute(insert, [row_values(obj)])
+            if after_chunk is not None:
+                after_chunk([obj])
+            db.session.commit()
+            result.ok(index, obj.id)
+        except Exception:
+            db.session.rollback()
+            result.fail(index, 409, 'Could not be inserted')
@@ -0,0 +1,12 @@
+from flask_restx import Resource
+
+from app import cache_api
+from app.reference import reference_index
+
+
+@cache_api.route('/stats')
+class CacheStats(Resource):
+    @cache_api.doc('get cache statistics')
+    def get(self):
+        """Size and rebuild counters of the in-memory country/city snapshot"""
+        return {"reference_index": reference_index.stats()}
@@ -3,34 +3,47 @@ from datetime import datetime
 
 from flask import request
 from flask_restx import Resource, fields
+from sqlalchemy import select
 
 from app import city_api, db, country_api
 from config import Config
 from models.city import City
 from models.country import Country
+from app.pagination import page_args
+from app.parents import city_parents
+from app.fieldsets import requested_fields, sparse_fields
+from app.serializers import city_with_country_code, sparse_serializer
+from app.reference import reference_index
+from app.conditional import check, check_row, validators
 
 city_model = city_api.model('City', {
     'name': fields.String(required=True, description='The city name'),
     'country_id': fields.String(required=True, description='The country identifier')
 })
 
+
+def city_versions():
+    """updated_at of each city and of the country whose code is in its response"""
+    return city_parents(select(City.updated_at, Country.updated_at))
+
+
 @city_api.route("/")
 class CityList(Resource):
-    @city_api.doc("get all cities")
+    @city_api.doc("get all cities", params={'limit': 'Page size', 'cursor': 'next_cursor of the previous page',
+                                            'fields': 'Comma-separated keys to return'})
     def get(self):
-        """Query all cities from the database"""
-        cities = City.query.filter_by(is_deleted=0).all()
-        result = []
-        for city in cities:
-            result.append({
-                "id": city.id,
-                "name": city.name,
-                "country_id": city.country_id,
-                "country_code": city.country.code,
-                "created_at": city.created_at.strftime(Config.datetime_format),
-                "updated_at": city.updated_at.strftime(Config.datetime_format)
-            })
-        return result
+        """One page of cities, served from the in-memory country/city snapshot"""
+        fieldset = requested_fields(city_api, city_with_country_code)
+        serialize = sparse_serializer(city_with_country_code, *fieldset)
+        limit, cursor = page_args(city_api)
+        try:
+            cities, next_cursor = reference_index.current().city_page(limit, cursor)
+        except ValueError:
+            city_api.abort(400, message='Invalid cursor')
+
+        versions = [city.updated_at for city in cities] + [city.country.updated_at for city in cities]
+        check(*validators(versions, len(cities), next_cursor))
+        return {"results": [serialize(city) for city in cities], "next_cursor": next_cursor}
 
     @city_api.doc('create a new city')
     @city_api.expect(city_model)
@@ -58,15 +71,9 @@ class CityList(Resource):
                 country_id=data['country_id'])
             db.session.add(new_city)
             db.session.commit()
+            reference_index.patch_city(new_city)
 
-            return {
-                "id": new_city.id,
-                "name": new_city.name,
-                "country_id": new_city.country_id,
-                "country_code": new_city.country.code,
-                "created_at": new_city.created_at.strftime(Config.datetime_format),
-                "updated_at": new_city.updated_at.strftime(Config.datetime_format)
-            }, 201
+            return city_with_country_code(new_city), 201
 
         except Exception as e:
             db.session.rollback()
@@ -74,21 +81,20 @@ class CityList(Resource):
 
 @city_api.route('/<string:city_id>')
 class CityById(Resource):
-    @city_api.doc('get_city')
+    @city_api.doc('get_city', params={'fields': 'Comma-separated keys to return'})
     def get(self, city_id):
         """Query the city by ID from the database"""
-        city = City.query.filter_by(id=city_id, is_deleted=0).first()
+        version = db.session.execute(city_versions().where(City.id == city_id)).first()
+        if version is None:
+            city_api.abort(404, message='City not found!')
+        check_row(version)
+
+        serialize, options = sparse_fields(city_api, city_with_country_code)
+        city = city_parents(City.query).options(*options).filter(City.id == city_id).first()
         if city is None:
             city_api.abort(404, message='City not found!')
         else:
-            return {
-                "id": city.id,
-                "name": city.name,
-                "country_id": city.country_id,
-                "country_code": city.country.code,
-                "created_at": city.created_at.strftime(Config.datetime_format),
-                "updated_at": city.updated_at.strftime(Config.datetime_format)
-            }
+            return serialize(city)
 
     @city_api.expect(city_model)
     def put(self, city_id):
@@ -96,7 +102,7 @@ class CityById(Resource):
         if not data:
             city_api.abort(400, "Invalid input")
 
-        city = City.query.filter_by(id=city_id, is_deleted=0).first()
+        city = City.query.filter_by(id=city_id).first()
         if not city:
             city_api.abort(404, 'City not found')
 
@@ -110,24 +116,21 @@ class CityById(Resource):
 
         city.updated_at = datetime.now()
         db.session.commit()
+        reference_index.patch_city(city)
 
-        return {
-            "id": city.id,
-            "name": city.name,
-            "country_id": city.country.id,
-            "country_code": city.country.code,
-            "created_at": city.created_at.strftime(Config.datetime_format),
-            "updated_at": city.updated_at.strftime(Config.datetime_format)
-        }
+        return city_with_country_code(city)
 
     @city_api.doc('Delete a specific city')
     def delete(self, city_id):
-        city = City.query.filter_by(id=city_id, is_deleted=0).first()
+        city = City.query.filter_by(id=city_id).first()
         if city is None:
             return city_api.abort(404, 'City not found')
+        removed_id = city.id
         try:
             city.is_deleted = 1
+            city.updated_at = datetime.now()
             db.session.commit()
+            reference_index.patch_city(removed_id=removed_id)
             return "delete successfully", 200
         except Exception as e:
             db.session.rollback()
@@ -135,22 +138,12 @@ class CityById(Resource):
 
 @city_api.route("/<string:country_code>/cities")
 class CountryCities(Resource):
-    @city_api.doc("get_country_cities")
+    @city_api.doc("get_country_cities", params={'fields': 'Comma-separated keys to return'})
     def get(self, country_code):
-        """Query all cities for a specific country from the database"""
-        country = Country.query.filter_by(code=country_code).first()
-        if not country:
+        """All cities of a country, served from the in-memory country/city snapshot"""
+        fieldset = requested_fields(city_api, city_with_country_code)
+        serialize = sparse_serializer(city_with_country_code, *fieldset)
+        result = reference_index.current().country_cities(country_code, serialize)
+        if result is None:
             city_api.abort(404, message='Country not found')
-
-        cities = City.query.filter_by(country_id=country.id, is_deleted=0).all()
-        result = []
-        for city in cities:
-            result.append({
-                "id": city.id,
-                "name": city.name,
-                "country_id": city.country_id,
-                "country_code": country_code,
-                "created_at": city.created_at.strftime(Config.datetime_format),
-                "updated_at": city.updated_at.strftime(Config.datetime_format)
-            })
         return result
\ No newline at end of file
@@ -0,0 +1,183 @@
+"""Maintenance commands, run with ``flask --app app <command>``"""
+import sqlite3
+
+import click
+from sqlalchemy import MetaData, and_, create_engine, func, insert, literal, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from app.ids import BinaryUUID, parse_id
+from app.soft_delete import include_deleted
+from config import Config
+from models.amenity import Amenity
+from models.place import Place, place_amenities
+from models.review import Review
+from models.user import User, normalize_email
+
+
+@app.cli.command('init-db')
+def init_db():
+    """Create any missing tables and indexes (e.g. for DB_PROFILE=sqlite)"""
+    db.create_all()
+    click.echo('Initialized {}'.format(db.engine.url.render_as_string(hide_password=True)))
+
+
+@app.cli.command('backfill-geohash')
+@click.option('--batch-size', default=1000, show_default=True)
+def backfill_geohash(batch_size):
+    """Fill places.geohash for rows that have coordinates but no geohash"""
+    updated = 0
+    while True:
+        places = include_deleted(Place.query).filter(Place.geohash.is_(None), Place.latitude.isnot(None),
+                                                     Place.longitude.isnot(None)).limit(batch_size).all()
+        if not places:
+            break
+        for place in places:
+            place.update_geohash()
+        db.session.commit()
+        updated += len(places)
+    click.echo('Updated {} places'.format(updated))
+
+
+@app.cli.command('rebuild-rating-aggregates')
+def rebuild_rating_aggregates():
+    """Recompute places.review_count / rating_sum from the reviews table in one UPDATE"""
+    live = and_(Review.place_id == Place.id, Review.is_deleted == 0)
+    review_count = select(func.count(Review.id)).where(live).scalar_subquery()
+    rating_sum = select(func.coalesce(func.sum(Review.rating), 0)).where(live).scalar_subquery()
+    result = db.session.execute(
+        update(Place)
+        .where(or_(Place.review_count != review_count, Place.rating_sum != rating_sum))
+        .values(review_count=review_count, rating_sum=rating_sum)
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+    click.echo('Repaired {} places'.format(result.rowcount))
+
+
+@app.cli.command('rebuild-amenity-masks')
+def rebuild_amenity_masks():
+    """Give amenities without a bit one (while bits last) and recompute places.amenity_mask from place_amenities"""
+    amenities = include_deleted(Amenity.query).filter(Amenity.bit.is_(None)) \
+        .order_by(Amenity.created_at, Amenity.id).all()
+    assigned = 0
+    for amenity in amenities:
+        amenity.bit = Amenity.next_bit()
+        if amenity.bit is None:
+            break
+        db.session.flush()
+        assigned += 1
+
+    amenity_mask = select(func.coalesce(func.sum(literal(1).bitwise_lshift(Amenity.bit)), 0)) \
+        .join_from(place_amenities, Amenity, place_amenities.c.amenity_id == Amenity.id) \
+        .where(place_amenities.c.place_id == Place.id, Amenity.bit.isnot(None)).scalar_subquery()
+    result = db.session.execute(
+        update(Place)
+        .where(Place.amenity_mask != amenity_mask)
+        .values(amenity_mask=amenity_mask)
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+    click.echo('Assigned {} amenity bits, repaired {} places'.format(assigned, result.rowcount))
+
+
+@app.cli.command('backfill-email-normalized')
+@click.option('--batch-size', default=1000, show_default=True)
+def backfill_email_normalized(batch_size):
+    """Fill users.email_normalized for rows created before the column existed.
+
+    Addresses that only differ in case collide on the unique index; those
+    rows are left empty and listed so they can be merged by hand.
+    """
+    updated = 0
+    conflicts = []
+    while True:
+        query = include_deleted(User.query).filter(User.email_normalized.is_(None))
+        if conflicts:
+            query = query.filter(User.id.notin_(conflicts))
+        users = query.limit(batch_size).all()
+        if not users:
+            break
+        for user in users:
+            user.email_normalized = normalize_email(user.email)
+        try:
+            db.session.commit()
+            updated += len(users)
+            continue
+        except IntegrityError:
+            db.session.rollback()
+        for user in users:
+            user.email_normalized = normalize_email(user.email)
+            try:
+                db.session.commit()
+                updated += 1
+            except IntegrityError:
+                db.session.rollback()
+                conflicts.append(user.id)
+    click.echo('Updated {} users'.format(updated))
+    for user_id in conflicts:
+        click.echo('Duplicate email, not normalized: user {}'.format(user_id))
+
+
+@app.cli.command('sync-sqlite-replicas')
+def sync_sqlite_replicas():
+    """Copy the SQLite primary over each SQLite replica (DB_PROFILE=sqlite-replica), standing in for replication"""
+    primary = db.engine.url
+    if primary.get_backend_name() != 'sqlite':
+        raise click.ClickException('The primary is not a SQLite database')
+    replicas = [db.engines[key].url for key in sorted(Config.SQLALCHEMY_BINDS)]
+    replicas = [url for url in replicas if url.get_backend_name() == 'sqlite']
+    if not replicas:
+        raise click.ClickException('No SQLite replicas are configured (DATABASE_REPLICA_URLS)')
+    source = sqlite3.connect(primary.database)
+    try:
+        for url in replicas:
+            target = sqlite3.connect(url.database)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+            click.echo('Copied {} to {}'.format(primary.database, url.database))
+    finally:
+        source.close()
+
+
+@app.cli.command('migrate-binary-ids')
+@click.argument('source_url')
+@click.option('--batch-size', default=1000, show_default=True)
+def migrate_binary_ids(source_url, batch_size):
+    """Copy a database whose ids are 36-character strings into this one, which stores them as 16 bytes.
+
+    Point DATABASE_URL at a new, empty database and pass the old one's URL;
+    the tables are created here and every row (soft-deleted ones included)
+    is copied in batches, parents before children. Existing ids keep their
+    value; rows created afterwards get time-ordered ids. Switch the
+    application over once the copy is done.
+    """
+    source = create_engine(source_url)
+    old = MetaData()
+    old.reflect(source)
+    db.create_all()
+    for table in db.metadata.sorted_tables:
+        if table.name not in old.tables:
+            click.echo('Skipped {} (not in the source database)'.format(table.name))
+            continue
+        if db.session.execute(select(func.count()).select_from(table)).scalar():
+            raise click.ClickException('{} is not empty; copy into a new database'.format(table.name))
+        old_table = old.tables[table.name]
+        names = [column.name for column in table.columns if column.name in old_table.columns]
+        id_names = [column.name for column in table.columns if isinstance(column.type, BinaryUUID)
+                    and column.name in old_table.columns]
+        copied = 0
+        with source.connect() as connection:
+            rows = connection.execution_options(yield_per=batch_size).execute(
+                select(*[old_table.c[name] for name in names]))
+            for batch in rows.partitions():
+                batch = [row._asdict() for row in batch]
+                for row in batch:
+                    for name in id_names:
+                        if row[name] is not None and parse_id(row[name]) is None:
+                            raise click.ClickException('{}.{} = {!r} is not a UUID'.format(
+                                table.name, name, row[name]))
+                with db.engine.begin() as target:
+                    target.execute(insert(table), batch)
+                copied += len(batch)
+        click.echo('Copied {} {}'.format(copied, table.name))
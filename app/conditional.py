@@ -0,0 +1,103 @@
+"""HTTP conditional GETs driven by ``updated_at``.
+
+A response's validators are derived from the ``updated_at`` of every row its
+body is built from (including nested host/city/country rows) plus, for
+collections, how many rows the page has and its first and last keys. The query string is part of the
+ETag because it selects the page. A client that sends a matching
+``If-None-Match`` or a recent enough ``If-Modified-Since`` gets an empty
+304 before anything is loaded or serialized.
+"""
+import hashlib
+from datetime import timezone
+
+from flask import Response, after_this_request, request
+from sqlalchemy import func, select
+from werkzeug.exceptions import HTTPException
+
+from app import db
+
+
+class NotModified(HTTPException):
+    code = 304
+    description = 'Not Modified'
+
+
+def make_validators(full_path, versions, *parts):
+    """``(etag, last_modified)`` for the body at ``full_path`` built from rows with these ``updated_at`` values"""
+    versions = [version for version in versions if version is not None]
+    last_modified = max(versions) if versions else None
+    stamp = last_modified.isoformat() if last_modified else ''
+    raw = '\x1f'.join([full_path, stamp] + [str(part) for part in parts])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest(), last_modified
+
+
+def validators(versions, *parts):
+    """Return ``(etag, last_modified)`` for the current request's body"""
+    return make_validators(request.full_path, versions, *parts)
+
+
+def http_last_modified(last_modified):
+    """updated_at is stored as naive local time; HTTP dates are UTC with one-second precision"""
+    if last_modified is None:
+        return None
+    return last_modified.replace(microsecond=0).astimezone(timezone.utc)
+
+
+def is_fresh(etag, last_modified, if_none_match, if_modified_since):
+    """True if the client's copy (werkzeug-parsed conditional headers) is current"""
+    if if_none_match:
+        return if_none_match.contains_weak(etag)
+    return if_modified_since is not None and last_modified is not None and last_modified <= if_modified_since
+
+
+def check(etag, last_modified):
+    """Answer 304 if the client's copy is current, otherwise send the validators with the response"""
+    last_modified = http_last_modified(last_modified)
+    fresh = is_fresh(etag, last_modified, request.if_none_match, request.if_modified_since)
+
+    response = Response(status=304)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    if fresh:
+        raise NotModified(response=response)
+
+    @after_this_request
+    def add_validators(result):
+        result.headers['ETag'] = response.headers['ETag']
+        if 'Last-Modified' in response.headers:
+            result.headers['Last-Modified'] = response.headers['Last-Modified']
+        return result
+
+
+def check_row(row):
+    """Validate a single resource from its (and its nested rows') ``updated_at`` values"""
+    check(*validators(row))
+
+
+def page_summary(versions_query, keys):
+    """One aggregate row over a page: row count, first and last value of each key, max of each version.
+
+    ``versions_query`` is the page query (already ordered and limited by
+    ``pagination.keyset``) selecting only ``updated_at`` columns. The key
+    range changes when a row inside the page is deleted and the next one
+    shifts in, which the count and versions alone would not show.
+    """
+    page = versions_query.add_columns(*[column.label('page_key_%d' % i)
+                                        for i, (column, _) in enumerate(keys)]).subquery()
+    columns = list(page.c)
+    versions, bounds = columns[:-len(keys)], columns[-len(keys):]
+    return select(func.count(), *[func.min(column) for column in bounds], *[func.max(column) for column in bounds],
+                  *[func.max(column) for column in versions]).select_from(page)
+
+
+def page_validators(full_path, row, keys):
+    """``make_validators`` for a ``page_summary`` row"""
+    width = 1 + 2 * len(keys)
+    return make_validators(full_path, row[width:], *row[:width])
+
+
+def check_page(versions_query, keys):
+    """Validate a page from one aggregate query over the page's version and key columns"""
+    row = db.session.execute(page_summary(versions_query, keys)).one()
+    check(*page_validators(request.full_path, row, keys))
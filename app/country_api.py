@@ -8,6 +8,9 @@ from app import country_api
 from config import Config
 from models.city import City
 from models.country import Country
+from app.pagination import paginate, default_keys
+from app.serializers import country_to_dict, city_to_dict
+from app.reference import reference_index
 
 """Define the Country model for the API documentation"""
 country_model = country_api.model('Country', {
@@ -21,62 +24,36 @@ country_model = country_api.model('Country', {
 class CountryList(Resource):
     @country_api.doc("get all countries")
     def get(self):
-        """Query all countries from the database"""
-        countries = Country.query.all()
-        result = []
-        """Convert each Country object to a dictionary"""
-        for country in countries:
-            result.append({
-                "id": country.id,
-                "name": country.name,
-                "code": country.code,
-                "created_at": country.created_at.strftime(Config.datetime_format),
-                "updated_at": country.updated_at.strftime(Config.datetime_format)
-            })
-        return result
+        """Query one page of countries from the database"""
+        countries, next_cursor = paginate(country_api, Country.query, default_keys(Country),
+                                          versions=Country.query.with_entities(Country.updated_at))
+        result = [country_to_dict(country) for country in countries]
+        return {"results": result, "next_cursor": next_cursor}
 
 
 @country_api.route('/<string:country_code>')
 class CountriesByCode(Resource):
     @country_api.doc('get_country')
     def get(self, country_code):
-        """Query the country by code from the database"""
-        country = Country.query.filter_by(code=country_code).first()
+        """Query the country by code, served from the in-memory country/city snapshot"""
+        country = reference_index.current().countries_by_code.get(country_code)
         if country is None:
             country_api.abort(400, message='Country not found!')
         else:
-            """Convert the Country object to a dictionary"""
-            return {
-                "id": country.id,
-                "name": country.name,
-                "code": country.code,
-                "created_at": country.created_at.strftime(Config.datetime_format),
-                "updated_at": country.updated_at.strftime(Config.datetime_format)
-            }
+            return country_to_dict(country)
 
 
 @country_api.route('/<string:country_code>/cities')
 class CountryCities(Resource):
     @country_api.doc('get_country_cities')
     def get(self, country_code):
-        country = Country.query.filter_by(code=country_code).first()
-        if country is None:
+        """Cities of a country, served from the in-memory country/city snapshot"""
+        result = reference_index.current().country_cities(country_code, city_to_dict)
+        if result is None:
             country_api.abort(400, message='Country not found!')
-
-        cities = City.query.filter_by(country_id=country.id, is_deleted=0).all()
-        if not cities:
+        if not result:
             country_api.abort(400, message='No cities found for the given country!')
 
-        result = []
-        for city in cities:
-            result.append({
-                "id": city.id,
-                "name": city.name,
-                "country_id": city.country_id,
-                "created_at": city.created_at.strftime(Config.datetime_format),
-                "updated_at": city.updated_at.strftime(Config.datetime_format)
-            })
-
         return result
 
 
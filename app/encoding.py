@@ -0,0 +1,116 @@
+"""Fast JSON encoding and Accept-Encoding compression for API responses.
+
+``dumps`` encodes with orjson when it is installed and JSON_ENCODER is
+``orjson`` (the default), and with the standard library otherwise. Both
+produce the same document (orjson without the optional spaces) and both
+encode datetime and UUID values natively. ``dumps`` is the Api's
+``application/json`` representation and is also used by the NDJSON streams
+and the async read paths.
+
+Bodies of at least COMPRESS_MIN_SIZE bytes are compressed with brotli (if
+the ``brotli`` package is installed) or gzip, whichever the client prefers
+in Accept-Encoding. Streamed responses are sent uncompressed, since
+compressing them would mean buffering the whole body. A compressed body is
+a different byte sequence, so its ETag is sent as a weak one.
+"""
+import gzip
+import json
+import uuid
+from datetime import date
+
+from flask import current_app, make_response, request
+
+from config import Config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+"""Encodings we can produce, in our order of preference"""
+ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def _default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError('Object of type %s is not JSON serializable' % type(value).__name__)
+
+
+def stdlib_dumps(data, indent=None):
+    """Encode ``data`` as UTF-8 JSON followed by a newline"""
+    return (json.dumps(data, indent=indent, default=_default) + '\n').encode('utf-8')
+
+
+def orjson_dumps(data, indent=None):
+    """``stdlib_dumps`` with orjson"""
+    option = orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    try:
+        return orjson.dumps(data, option=option)
+    except orjson.JSONEncodeError:
+        # orjson refuses a few things json accepts, such as integers wider than 64 bits
+        return stdlib_dumps(data, indent)
+
+
+dumps = orjson_dumps if orjson is not None and Config.JSON_ENCODER == 'orjson' else stdlib_dumps
+
+
+def output_json(data, code, headers=None):
+    """The Api's ``application/json`` representation"""
+    response = make_response(dumps(data, indent=4 if current_app.debug else None), code)
+    response.headers.extend(headers or {})
+    return response
+
+
+def should_compress(size):
+    return Config.COMPRESS_ENABLED and size >= Config.COMPRESS_MIN_SIZE
+
+
+def negotiate(accept_encodings):
+    """The encoding the client prefers (werkzeug-parsed Accept-Encoding) among ``ENCODINGS``, or None"""
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=Config.COMPRESS_BROTLI_QUALITY)
+    # mtime=0 keeps the output (and so any cache keyed on it) identical for identical bodies
+    return gzip.compress(data, compresslevel=Config.COMPRESS_LEVEL, mtime=0)
+
+
+def _compressible(response):
+    if response.is_streamed or response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return False
+    mimetype = response.mimetype or ''
+    if mimetype != 'application/json' and not mimetype.startswith('text/'):
+        return False
+    return should_compress(response.content_length or 0)
+
+
+def init_encoding(app, api):
+    api.representations['application/json'] = output_json
+
+    @app.after_request
+    def compress_response(response):
+        if not _compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        response.set_data(compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
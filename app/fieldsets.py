@@ -0,0 +1,136 @@
+"""Sparse fieldsets: ``?fields=`` and ``?fields[<nested>]=``.
+
+``?fields=id,name,price_per_night`` keeps only those keys of each result and
+``?fields[user]=id,first_name`` does the same for a nested object. The
+matching serializer is compiled once per fieldset
+(``serializers.sparse_serializer``), and the query gets ``load_only``
+options so only the columns behind the requested keys are selected.
+
+Nested objects are filled with ``contains_eager`` from the joins the query
+makes with ``app.parents``. A nested object that is not requested keeps its
+join, which drops rows whose parent is soft-deleted, but none of its
+columns are selected.
+"""
+from functools import lru_cache
+
+from flask import request
+from sqlalchemy import inspect
+from sqlalchemy.orm import contains_eager, load_only
+
+from app.serializers import DEPENDS_ON, field_key, sparse_serializer
+
+
+def _parse(value):
+    return frozenset(name.strip() for name in value.split(',') if name.strip())
+
+
+def _check(names, allowed, label):
+    unknown = names - set(allowed)
+    if unknown:
+        raise ValueError('Unknown field(s) for {}: {}; available: {}'.format(
+            label, ', '.join(sorted(unknown)), ', '.join(allowed)))
+
+
+def parse_fieldset(args, serializer):
+    """Read the fieldset from query ``args`` as ``(keys, nested)`` for ``sparse_serializer``.
+
+    Returns ``(None, ())`` when the client did not ask for one and raises
+    ValueError for names ``serializer`` does not produce.
+    """
+    keys = None
+    if 'fields' in args:
+        keys = _parse(args['fields'])
+        _check(keys, [field_key(field) for field in serializer.fields], 'fields')
+
+    nested = []
+    for field in serializer.fields:
+        if isinstance(field, str) or len(field) != 3:
+            continue
+        param = 'fields[%s]' % field[0]
+        if param in args:
+            names = _parse(args[param])
+            _check(names, [field_key(item) for item in field[1].fields], param)
+            nested.append((field[0], names))
+    return keys, tuple(sorted(nested, key=lambda item: item[0]))
+
+
+def requested_fields(namespace, serializer):
+    """``parse_fieldset`` for the current request, answering 400 for unknown names"""
+    try:
+        return parse_fieldset(request.args, serializer)
+    except ValueError as e:
+        namespace.abort(400, message=str(e))
+
+
+def _needs(serializer):
+    """``(columns, {relationship: needs})`` that ``serializer`` reads"""
+    columns = set()
+    relations = {}
+    attributes = inspect(serializer.model).column_attrs.keys()
+    for field in serializer.fields:
+        if isinstance(field, str):
+            if field in attributes:
+                columns.add(field)
+            else:
+                columns.update(DEPENDS_ON.get((serializer.model, field), ()))
+        elif len(field) == 2:
+            path = field[1].split('.')
+            if len(path) == 1:
+                columns.add(path[0])
+            else:
+                relations.setdefault(path[0], (set(), {}))[0].add(path[1])
+        else:
+            child_columns, child_relations = _needs(field[1])
+            merged = relations.setdefault(field[2], (set(), {}))
+            merged[0].update(child_columns)
+            merged[1].update(child_relations)
+    return columns, relations
+
+
+def _load(model, needs, extra=()):
+    columns, relations = needs
+    mapper = inspect(model)
+    names = sorted(set(columns) | set(extra)) or [column.key for column in mapper.primary_key]
+    options = [load_only(*[getattr(model, name) for name in names])]
+    for key, child in sorted(relations.items()):
+        options.append(contains_eager(getattr(model, key))
+                       .options(*_load(mapper.relationships[key].mapper.class_, child)))
+    return options
+
+
+@lru_cache(maxsize=256)
+def eager_options(serializer):
+    """``contains_eager`` for each relationship ``serializer`` reads, selecting just the nested columns it shows.
+
+    The query must join those relationships (``app.parents``).
+    """
+    _, relations = _needs(serializer)
+    mapper = inspect(serializer.model)
+    return tuple(contains_eager(getattr(serializer.model, key))
+                 .options(*_load(mapper.relationships[key].mapper.class_, child))
+                 for key, child in sorted(relations.items()))
+
+
+@lru_cache(maxsize=256)
+def load_options(serializer, extra=()):
+    """Loader options selecting just the columns ``serializer`` (and ``extra`` columns) need"""
+    return tuple(_load(serializer.model, _needs(serializer), extra))
+
+
+def resolve_fieldset(fieldset, serializer, keys=()):
+    """Return ``(serialize, options)`` for a fieldset from ``parse_fieldset``.
+
+    ``keys`` are the pagination keys, which are loaded even when not
+    requested so the next cursor can be built. Without a fieldset the
+    serializer is returned unchanged with just its ``eager_options``.
+    """
+    fields, nested = fieldset
+    if fields is None and not nested:
+        return serializer, eager_options(serializer)
+    sparse = sparse_serializer(serializer, fields, nested)
+    return sparse, load_options(sparse, tuple(column.key for column, _ in keys))
+
+
+def sparse_fields(namespace, serializer, keys=()):
+    """``resolve_fieldset`` for the fieldset this request asks for"""
+    return resolve_fieldset(requested_fields(namespace, serializer), serializer, keys)
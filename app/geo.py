@@ -0,0 +1,85 @@
+"""Geohash helpers for the "places near me" query.
+
+Places store the geohash of their coordinates in an indexed column. A radius
+query picks the finest geohash precision whose cells are still at least as
+big as the radius; the circle is then covered by the centre cell and its 8
+neighbours. Each of those 9 prefixes is an index range scan, and only the
+candidates they return get an exact haversine distance.
+"""
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+MAX_PRECISION = 12
+
+
+def encode_geohash(latitude, longitude, precision=MAX_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = bits * 2 + 1
+                lon_range[0] = mid
+            else:
+                bits = bits * 2
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = bits * 2 + 1
+                lat_range[0] = mid
+            else:
+                bits = bits * 2
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """Return the ``(lat_degrees, lon_degrees)`` covered by one cell"""
+    lat_bits = 5 * precision // 2
+    lon_bits = 5 * precision - lat_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def covering_prefixes(latitude, longitude, radius_km):
+    """Geohash prefixes whose cells together contain the whole search circle.
+
+    Returns ``['']`` (i.e. everything) when the circle is too big for any
+    precision, which only happens for huge radii or right at the poles.
+    """
+    # Longitude degrees shrink towards the poles, so size cells for the circle's poleward edge
+    poleward = min(abs(latitude) + radius_km / KM_PER_DEGREE, 90.0)
+    lon_scale = max(math.cos(math.radians(poleward)), 1e-9)
+    for precision in range(MAX_PRECISION, 0, -1):
+        dlat, dlon = cell_size(precision)
+        if dlat * KM_PER_DEGREE >= radius_km and dlon * KM_PER_DEGREE * lon_scale >= radius_km:
+            break
+    else:
+        return ['']
+
+    prefixes = set()
+    for i in (-1, 0, 1):
+        lat = min(max(latitude + i * dlat, -90.0), 90.0)
+        for j in (-1, 0, 1):
+            lon = (longitude + j * dlon + 180.0) % 360.0 - 180.0
+            prefixes.add(encode_geohash(lat, lon, precision))
+    return sorted(prefixes)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
@@ -0,0 +1,123 @@
+"""bcrypt password hashing off the request thread.
+
+Hashes are computed in a bounded process pool so a sign-up does not hold a
+worker thread's CPU for the ~250 ms a bcrypt round costs. Only functions of
+the ``bcrypt`` module itself are sent to the pool, so the tasks need nothing
+from the Flask app. The ``spawn`` workers do re-run the main script, though,
+which is why ``app.py`` only imports the app under its ``__main__`` guard.
+At most ``BCRYPT_MAX_PENDING`` hashes wait for the pool, bulk ones included;
+past that, callers get ``HashingBusy`` and should answer 503.
+
+Set ``BCRYPT_POOL_SIZE=0`` to hash inline on the calling thread instead.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+from config import Config
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(Config.BCRYPT_MAX_PENDING)
+
+
+class HashingBusy(Exception):
+    """Too many hashes are already waiting for the pool"""
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=Config.BCRYPT_POOL_SIZE,
+                                                mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+def _run(func, *args):
+    if not Config.BCRYPT_POOL_SIZE:
+        return func(*args)
+    if not _pending.acquire(timeout=Config.BCRYPT_QUEUE_TIMEOUT):
+        raise HashingBusy()
+    try:
+        return _pool().submit(func, *args).result()
+    except BrokenProcessPool:
+        # A worker died; start a fresh pool next time and answer this call inline
+        shutdown()
+        return func(*args)
+    finally:
+        _pending.release()
+
+
+def _run_many(func, calls):
+    """``_run`` for a batch of calls: each one takes a ``_pending`` slot for as long as it is in flight"""
+    acquired = 0
+    try:
+        for _ in calls:
+            if not _pending.acquire(timeout=Config.BCRYPT_QUEUE_TIMEOUT):
+                raise HashingBusy()
+            acquired += 1
+        try:
+            futures = [_pool().submit(func, *args) for args in calls]
+            return [future.result() for future in futures]
+        except BrokenProcessPool:
+            shutdown()
+            return [func(*args) for args in calls]
+    finally:
+        for _ in range(acquired):
+            _pending.release()
+
+
+def hash_password(password):
+    salt = bcrypt.gensalt(Config.BCRYPT_LOG_ROUNDS)
+    return _run(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+
+def hash_passwords(passwords):
+    """Hash many passwords across the pool, e.g. for bulk imports.
+
+    They go through the same bounded queue as ``hash_password``, at most
+    ``BCRYPT_POOL_SIZE`` (and never more than ``BCRYPT_MAX_PENDING``) at a
+    time, so a large import shares the pool with concurrent sign-ups
+    instead of filling it. Raises ``HashingBusy`` like ``hash_password``.
+    """
+    if not Config.BCRYPT_POOL_SIZE:
+        return [hash_password(password) for password in passwords]
+    # A chunk takes one queue slot per password, so it must fit in the queue
+    size = min(Config.BCRYPT_POOL_SIZE, Config.BCRYPT_MAX_PENDING)
+    hashes = []
+    for start in range(0, len(passwords), size):
+        chunk = passwords[start:start + size]
+        calls = [(password.encode('utf-8'), bcrypt.gensalt(Config.BCRYPT_LOG_ROUNDS)) for password in chunk]
+        hashes.extend(hashed.decode('utf-8') for hashed in _run_many(bcrypt.hashpw, calls))
+    return hashes
+
+
+def check_password(hashed, password):
+    """Verify ``password`` against a stored hash; unreadable hashes never match"""
+    if not isinstance(hashed, str) or not hashed.startswith('$2'):
+        return False
+    try:
+        return _run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+    except ValueError:
+        return False
+
+
+def needs_rehash(hashed):
+    """True when ``hashed`` was made with a lower cost factor than the configured one"""
+    try:
+        return int(hashed.split('$')[2]) < Config.BCRYPT_LOG_ROUNDS
+    except (AttributeError, IndexError, ValueError):
+        return True
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
@@ -0,0 +1,95 @@
+"""Primary keys: time-ordered UUIDs stored as 16 bytes.
+
+Ids are generated by ``uuid7`` (a 48-bit millisecond timestamp, a 12-bit
+sequence and 62 random bits, the UUIDv7 layout), so new rows land at the
+end of the primary key index instead of at random places in it.
+``BinaryUUID`` columns keep them as ``BINARY(16)`` on MySQL (a BLOB
+elsewhere) while models, queries and the API keep using the usual
+36-character string form.
+
+The lower-case hex string sorts like the bytes, so ``(created_at, id)``
+orderings computed in Python agree with the database.
+"""
+import os
+import threading
+import time
+import uuid
+
+from sqlalchemy import types
+from sqlalchemy.dialects import mysql
+
+_VARIANT = 0x2 << 62
+_lock = threading.Lock()
+_last = [0, 0]
+
+
+def uuid7():
+    """A new UUIDv7 in its string form, greater than every earlier one from this process"""
+    with _lock:
+        millis, sequence = int(time.time() * 1000), 0
+        if millis <= _last[0]:
+            # Same millisecond (or the clock went back): count up, borrowing the next millisecond on overflow
+            millis, sequence = _last[0], _last[1] + 1
+            if sequence > 0xFFF:
+                millis, sequence = millis + 1, 0
+        _last[:] = millis, sequence
+    value = (millis & 0xFFFFFFFFFFFF) << 80 | 0x7 << 76 | sequence << 64 | _VARIANT \
+        | int.from_bytes(os.urandom(8), 'big') >> 2
+    return format_id(value.to_bytes(16, 'big'))
+
+
+def format_id(value):
+    """The string form of 16 id bytes"""
+    text = value.hex()
+    return '%s-%s-%s-%s-%s' % (text[:8], text[8:12], text[12:16], text[16:20], text[20:])
+
+
+def parse_id(value):
+    """The 16 bytes of a UUID string, or None if it is not one"""
+    if isinstance(value, str) and len(value) == 36 and value[8] == value[13] == value[18] == value[23] == '-':
+        # The canonical form, which is nearly every value: skip the uuid.UUID round trip
+        try:
+            raw = bytes.fromhex(value.replace('-', ''))
+        except ValueError:
+            return None
+        return raw if len(raw) == 16 else None
+    if isinstance(value, uuid.UUID):
+        return value.bytes
+    try:
+        return uuid.UUID(value).bytes
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class BinaryUUID(types.TypeDecorator):
+    """A UUID string in Python, 16 raw bytes in the database.
+
+    A value that is not a UUID binds as an empty byte string, which no
+    stored id equals, so looking up a malformed id finds nothing as it did
+    when ids were strings.
+    """
+    impl = types.LargeBinary
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'mysql':
+            return dialect.type_descriptor(mysql.BINARY(16))
+        return dialect.type_descriptor(types.LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        raw = parse_id(value)
+        return raw if raw is not None else b''
+
+    def literal_processor(self, dialect):
+        """``X'..'`` literals for statements compiled with ``literal_binds`` (the binary type only renders text)"""
+        def process(value):
+            raw = self.process_bind_param(value, dialect)
+            return 'NULL' if raw is None else "X'%s'" % raw.hex()
+        return process
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return format_id(bytes(value))
@@ -0,0 +1,245 @@
+"""Prometheus metrics served at ``/metrics``.
+
+Recording a request only touches a store owned by the current thread (no
+locks, a dict lookup and a few integer increments), so it costs a couple of
+microseconds. The per-thread stores are merged when ``/metrics`` is
+scraped; stores of threads that have exited are folded into one retired
+store so servers that start a thread per request do not grow without bound.
+
+Exposed series:
+
+* ``hbnb_http_request_duration_seconds`` histogram by namespace, route, method, status
+* ``hbnb_http_requests_in_flight`` gauge
+* ``hbnb_http_aborts_total`` counter of 4xx answers (``abort()`` paths such as 404/409)
+* ``hbnb_db_pool_*`` gauges from the SQLAlchemy connection pool
+* ``hbnb_db_routed_requests_total`` counter by the bind a request read from
+* ``hbnb_reference_index_*`` rebuild/patch counters and sizes of the country/city snapshot
+* ``hbnb_review_queue_*`` depth and outcome counters of the write-behind review queue
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, request
+
+from app import db
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Store(object):
+    """Counters written by exactly one thread"""
+    __slots__ = ('thread', 'latencies', 'aborts', 'in_flight', 'routed')
+
+    def __init__(self, thread):
+        self.thread = thread
+        # (endpoint, method, status) -> [bucket counts..., +Inf count, sum]
+        self.latencies = {}
+        self.aborts = {}
+        self.in_flight = 0
+        # replica bind key (None is the primary) -> requests
+        self.routed = {}
+
+    def merge(self, other):
+        for key, values in list(other.latencies.items()):
+            mine = self.latencies.get(key)
+            if mine is None:
+                self.latencies[key] = list(values)
+            else:
+                for i, value in enumerate(values):
+                    mine[i] += value
+        for key, count in list(other.aborts.items()):
+            self.aborts[key] = self.aborts.get(key, 0) + count
+        self.in_flight += other.in_flight
+        for bind, count in list(other.routed.items()):
+            self.routed[bind] = self.routed.get(bind, 0) + count
+
+
+_local = threading.local()
+_stores = []
+_stores_lock = threading.Lock()
+_retired = _Store(None)
+
+
+def _store():
+    try:
+        return _local.store
+    except AttributeError:
+        store = _local.store = _Store(threading.current_thread())
+        with _stores_lock:
+            _stores.append(store)
+        return store
+
+
+def _record(endpoint, method, status, elapsed):
+    store = _store()
+    key = (endpoint, method, status)
+    values = store.latencies.get(key)
+    if values is None:
+        values = store.latencies[key] = [0] * (len(BUCKETS) + 2)
+    values[bisect_left(BUCKETS, elapsed)] += 1
+    values[-1] += elapsed
+    if 400 <= status < 500:
+        store.aborts[key] = store.aborts.get(key, 0) + 1
+
+
+def request_started():
+    """Count a request served outside Flask (``app.async_api``) as in flight; returns its start time"""
+    _store().in_flight += 1
+    return time.perf_counter()
+
+
+def request_finished(endpoint, method, status, started):
+    """Record a request begun with ``request_started`` under its Flask endpoint name"""
+    _store().in_flight -= 1
+    _record(endpoint, method, status, time.perf_counter() - started)
+
+
+def request_routed(bind):
+    """Count a request that reads from ``bind`` (None for the primary)"""
+    store = _store()
+    store.routed[bind] = store.routed.get(bind, 0) + 1
+
+
+def collect():
+    """Merge every thread's store into a fresh one, retiring the stores of finished threads"""
+    total = _Store(None)
+    with _stores_lock:
+        for store in list(_stores):
+            if not store.thread.is_alive():
+                _retired.merge(store)
+                _stores.remove(store)
+            else:
+                total.merge(store)
+        total.merge(_retired)
+    return total
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join('%s="%s"' % (name, _escape(value)) for name, value in labels.items()) + '}'
+
+
+class Routes(object):
+    """Resolve endpoint names to (namespace, route template) labels, built on first use"""
+
+    def __init__(self, app, api):
+        self.app = app
+        self.api = api
+        self._labels = None
+
+    def __call__(self, endpoint):
+        if self._labels is None:
+            names = sorted((ns.name for ns in self.api.namespaces), key=len, reverse=True)
+            labels = {}
+            for rule in self.app.url_map.iter_rules():
+                namespace = next((name for name in names if rule.endpoint.startswith(name + '_')), '')
+                labels[rule.endpoint] = (namespace, rule.rule)
+            self._labels = labels
+        return self._labels.get(endpoint, ('', endpoint or 'unmatched'))
+
+
+def render(routes):
+    store = collect()
+    lines = []
+
+    name = 'hbnb_http_request_duration_seconds'
+    lines.append('# HELP %s Request latency by namespace, route, method and status' % name)
+    lines.append('# TYPE %s histogram' % name)
+    for (endpoint, method, status), values in sorted(store.latencies.items(), key=str):
+        namespace, route = routes(endpoint)
+        labels = dict(namespace=namespace, route=route, method=method, status=status)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, values):
+            cumulative += count
+            lines.append('%s_bucket%s %d' % (name, _labels(le=repr(bound), **labels), cumulative))
+        cumulative += values[len(BUCKETS)]
+        lines.append('%s_bucket%s %d' % (name, _labels(le='+Inf', **labels), cumulative))
+        lines.append('%s_sum%s %.6f' % (name, _labels(**labels), values[-1]))
+        lines.append('%s_count%s %d' % (name, _labels(**labels), cumulative))
+
+    lines.append('# HELP hbnb_http_requests_in_flight Requests being handled right now')
+    lines.append('# TYPE hbnb_http_requests_in_flight gauge')
+    lines.append('hbnb_http_requests_in_flight %d' % store.in_flight)
+
+    name = 'hbnb_http_aborts_total'
+    lines.append('# HELP %s Requests answered with a 4xx status' % name)
+    lines.append('# TYPE %s counter' % name)
+    for (endpoint, method, status), count in sorted(store.aborts.items(), key=str):
+        namespace, route = routes(endpoint)
+        lines.append('%s%s %d' % (name, _labels(namespace=namespace, route=route, method=method, status=status),
+                                  count))
+
+    pool = db.engine.pool
+    for metric, help_text in (('size', 'Configured pool size'),
+                              ('checkedout', 'Connections currently checked out'),
+                              ('overflow', 'Connections open beyond pool_size'),
+                              ('checkedin', 'Idle connections in the pool')):
+        reader = getattr(pool, metric, None)
+        if reader is None:
+            continue
+        lines.append('# HELP hbnb_db_pool_%s %s' % (metric, help_text))
+        lines.append('# TYPE hbnb_db_pool_%s gauge' % metric)
+        # QueuePool.overflow() counts down from -pool_size while the pool is still filling
+        lines.append('hbnb_db_pool_%s %d' % (metric, max(reader(), 0)))
+
+    if store.routed:
+        name = 'hbnb_db_routed_requests_total'
+        lines.append('# HELP %s Requests by the database they read from' % name)
+        lines.append('# TYPE %s counter' % name)
+        for bind, count in sorted(store.routed.items(), key=lambda item: item[0] or ''):
+            lines.append('%s%s %d' % (name, _labels(bind=bind or 'primary'), count))
+
+    from app.reference import reference_index
+    stats = reference_index.stats()
+    for metric in ('rebuilds', 'patches'):
+        lines.append('# TYPE hbnb_reference_index_%s_total counter' % metric)
+        lines.append('hbnb_reference_index_%s_total %d' % (metric, stats[metric]))
+    for metric in ('countries', 'cities'):
+        lines.append('# TYPE hbnb_reference_index_%s gauge' % metric)
+        lines.append('hbnb_reference_index_%s %d' % (metric, stats[metric]))
+
+    from app.review_api import review_queue
+    stats = review_queue.stats()
+    lines.append('# HELP hbnb_review_queue_depth Reviews accepted but not yet written')
+    lines.append('# TYPE hbnb_review_queue_depth gauge')
+    lines.append('hbnb_review_queue_depth %d' % stats['queued'])
+    for metric in ('written', 'failed', 'batches'):
+        lines.append('# TYPE hbnb_review_queue_%s_total counter' % metric)
+        lines.append('hbnb_review_queue_%s_total %d' % (metric, stats[metric]))
+    return '\n'.join(lines) + '\n'
+
+
+def init_metrics(app, api):
+    if not app.config.get('METRICS_ENABLED'):
+        return
+    routes = Routes(app, api)
+
+    @app.before_request
+    def start_metrics():
+        g.metrics_started = time.perf_counter()
+        _store().in_flight += 1
+
+    @app.after_request
+    def record_metrics(response):
+        # Latency is time to the response headers; a streamed body is not included
+        started = g.get('metrics_started')
+        if started is not None:
+            _record(request.endpoint, request.method, response.status_code, time.perf_counter() - started)
+        return response
+
+    @app.teardown_request
+    def end_metrics(exception=None):
+        if g.pop('metrics_started', None) is not None:
+            _store().in_flight -= 1
+
+    def metrics():
+        return Response(render(routes), content_type=CONTENT_TYPE)
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -0,0 +1,128 @@
+"""Keyset (cursor) pagination shared by every list endpoint.
+
+A page is ordered by a list of key columns, ``(created_at, id)`` by default,
+and the next page is selected with a ``WHERE`` on the last key values seen
+instead of ``OFFSET``, so a deep page costs the same as the first one.
+The cursor handed to clients is an opaque url-safe string.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from flask import request
+from sqlalchemy import and_, or_
+
+from app.conditional import check_page
+from config import Config
+
+
+def default_keys(model):
+    """The ``(created_at, id)`` ordering used by the plain list endpoints"""
+    return [(model.created_at, False), (model.id, False)]
+
+
+def encode_cursor(values):
+    payload = []
+    for value in values:
+        if isinstance(value, datetime):
+            payload.append({"dt": value.isoformat()})
+        else:
+            payload.append(value)
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """Turn a cursor back into key values, raising ValueError if it was tampered with"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(payload, list) or len(payload) != size:
+        raise ValueError('Invalid cursor')
+    values = []
+    for value in payload:
+        if isinstance(value, dict):
+            if not isinstance(value.get('dt'), str):
+                raise ValueError('Invalid cursor')
+            value = datetime.fromisoformat(value['dt'])
+        elif not isinstance(value, (str, int, float)):
+            raise ValueError('Invalid cursor')
+        values.append(value)
+    return values
+
+
+def _after(keys, values):
+    """Build ``(k1 > v1) OR (k1 = v1 AND k2 > v2) OR ...``.
+
+    The expanded form is used rather than a row-value comparison because
+    MySQL only plans a range scan on the ``(created_at, id)`` index for it.
+    """
+    clauses = []
+    for i, (column, descending) in enumerate(keys):
+        equal = [keys[j][0] == values[j] for j in range(i)]
+        step = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*equal, step))
+    return or_(*clauses)
+
+
+def keyset(query, keys, limit, cursor=None):
+    """Order, filter and limit a Query (or Select) to one page.
+
+    One row more than ``limit`` is fetched so ``split_page`` can tell whether
+    another page exists without a COUNT.
+    """
+    if cursor:
+        query = query.filter(_after(keys, decode_cursor(cursor, len(keys))))
+    order = [column.desc() if descending else column.asc() for column, descending in keys]
+    return query.order_by(*order).limit(limit + 1)
+
+
+def split_page(rows, keys, limit):
+    """Drop the look-ahead row and build ``next_cursor`` from the last row kept"""
+    rows = list(rows)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor([getattr(last, column.key) for column, _ in keys])
+
+
+def parse_limit(value):
+    """Validate a ``?limit=`` value, raising ValueError with the message for the client"""
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid limit')
+    if limit < 1 or limit > Config.PAGE_SIZE_MAX:
+        raise ValueError('limit must be between 1 and {}'.format(Config.PAGE_SIZE_MAX))
+    return limit
+
+
+def page_args(namespace):
+    """Read ``limit`` and ``cursor`` from the query string"""
+    try:
+        limit = parse_limit(request.args.get('limit', Config.PAGE_SIZE_DEFAULT))
+    except ValueError as e:
+        namespace.abort(400, message=str(e))
+    return limit, request.args.get('cursor')
+
+
+def paginate(namespace, query, keys, versions=None):
+    """Fetch the page requested by ``?limit=&cursor=`` and return ``(rows, next_cursor)``.
+
+    ``versions`` is an optional query with the same filters as ``query`` that
+    selects the ``updated_at`` columns the page is built from; when given,
+    the page is validated with ``conditional.check_page`` first and a
+    conditional GET may end here with a 304.
+    """
+    limit, cursor = page_args(namespace)
+    try:
+        page = keyset(query, keys, limit, cursor)
+    except ValueError:
+        namespace.abort(400, message='Invalid cursor')
+    if versions is not None:
+        check_page(keyset(versions, keys, limit, cursor), keys)
+    return split_page(page.all(), keys, limit)
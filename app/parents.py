@@ -0,0 +1,38 @@
+"""Inner joins to the parent rows a place, review or city response shows.
+
+The many-to-one relationships (host, city, country, user, place) load
+lazily by default. The read endpoints add these joins to their query and
+to the matching ``*_versions`` query, so a row whose parent is
+soft-deleted is left out of both: a place of a deleted host, city or
+country is not listed, and neither is a review of a deleted user or
+place. The nested objects a serializer shows are then filled from the
+joined rows with ``contains_eager`` (``fieldsets.eager_options``), still
+one query per page.
+"""
+from sqlalchemy.orm import aliased
+
+from models.city import City
+from models.country import Country
+from models.place import Place
+from models.review import Review
+from models.user import User
+
+
+def city_parents(query):
+    """``query`` (a Query or Select over cities) joined to the country"""
+    return query.join(Country, City.country_id == Country.id)
+
+
+def place_parents(query, host=User):
+    """``query`` over places joined to the host, the city and its country"""
+    return city_parents(query.join(host, Place.host_id == host.id).join(City, Place.city_id == City.id))
+
+
+def review_parents(query):
+    """``query`` over reviews joined to the author and the place with its parents.
+
+    The place's host is an alias so ``User`` stays the author, which
+    ``contains_eager(Review.user)`` loads.
+    """
+    query = query.join(User, Review.user_id == User.id).join(Place, Review.place_id == Place.id)
+    return place_parents(query, host=aliased(User))
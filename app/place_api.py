@@ -3,15 +3,27 @@ from datetime import datetime
 
 from flask import request
 from flask_restx import Resource, fields
+from sqlalchemy import and_, or_, select
+from sqlalchemy.exc import IntegrityError
 
 from app import place_api, db
 from config import Config
 from models import place
-from models.place import Place
+from models.place import Place, place_amenities
+from models.amenity import Amenity
 from models.review import Review
 from models.user import User
 from models.city import City
-from app.review_api import review_model
+from app.review_api import review_model, save_review, valid_rating
+from app.pagination import paginate, default_keys, parse_limit
+from app.parents import place_parents, review_parents
+from app.streaming import wants_stream, stream_query
+from app.geo import covering_prefixes, haversine_km
+from app.bulk import BulkResult, bulk_items, existing_values, insert_chunks
+from app.conditional import check_row
+from app.fieldsets import sparse_fields
+from app.amenity_filter import amenity_filter
+from app.serializers import amenity_to_dict, place_to_dict, place_detail, review_to_dict, review_with_user, user_to_dict, city_to_dict
 
 """Define the Place model for the API documentation"""
 place_model = place_api.model('Place', {
@@ -29,48 +41,46 @@ place_model = place_api.model('Place', {
 })
 
 
+def valid_coordinates(latitude, longitude):
+    """Latitude/longitude must both be numbers in range, or both be missing"""
+    if latitude is None and longitude is None:
+        return True
+    for value, bound in ((latitude, 90), (longitude, 180)):
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not -bound <= value <= bound:
+            return False
+    return True
+
+
+def place_versions():
+    """updated_at of each place and of the host and city nested in its response"""
+    return place_parents(select(Place.updated_at, User.updated_at, City.updated_at))
+
+
 @place_api.route("")
 class PlaceList(Resource):
-    @place_api.doc("get all places")
+    @place_api.doc("get all places", params={'limit': 'Page size', 'cursor': 'next_cursor of the previous page',
+                                             'stream': 'Set to 1 to stream every place as NDJSON',
+                                             'fields': 'Comma-separated keys to return',
+                                             'fields[user]': 'Keys of the nested host',
+                                             'fields[city]': 'Keys of the nested city',
+                                             'amenities': 'Comma-separated amenity ids the places must have',
+                                             'amenity_match': 'all (default) or any of the amenities'})
+    @place_api.response(400, 'Invalid input')
     def get(self):
-        """Query all places from the database"""
-        places = Place.query.all()
-        result = []
-        """Convert each Place object to a dictionary"""
-        for place in places:
-            result.append({
-                "id": place.id,
-                "host_id": place.host_id,
-                "city_id": place.city_id,
-                "name": place.name,
-                "description": place.description,
-                "address": place.address,
-                "latitude": place.latitude,
-                "longitude": place.longitude,
-                "number_of_rooms": place.number_of_rooms,
-                "number_of_bathrooms": place.number_of_bathrooms,
-                "price_per_night": place.price_per_night,
-                "max_guests": place.max_guests,
-                "created_at": place.created_at.strftime(Config.datetime_format),
-                "updated_at": place.updated_at.strftime(Config.datetime_format),
-                "user": {
-                    "id": place.host.id,
-                    "first_name": place.host.first_name,
-                    "last_name": place.host.last_name,
-                    "email": place.host.email,
-                    "password": place.host.password,
-                    "created_at": place.host.created_at.strftime(Config.datetime_format),
-                    "updated_at": place.host.updated_at.strftime(Config.datetime_format),
-                },
-                "city": {
-                    "id": place.city.id,
-                    "name": place.city.name,
-                    "country_id": place.city.country_id,
-                    "created_at": place.city.created_at.strftime(Config.datetime_format),
-                    "updated_at": place.city.updated_at.strftime(Config.datetime_format),
-                }
-            })
-        return result
+        """Query one page of places from the database, or stream all of them"""
+        serialize, options = sparse_fields(place_api, place_detail, default_keys(Place))
+        query = place_parents(Place.query).options(*options)
+        versions = place_versions()
+        criterion = amenity_filter(place_api)
+        if criterion is not None:
+            query = query.filter(criterion)
+            versions = versions.where(criterion)
+        if wants_stream():
+            return stream_query(query.order_by(Place.created_at, Place.id), serialize)
+
+        places, next_cursor = paginate(place_api, query, default_keys(Place), versions=versions)
+        result = [serialize(place) for place in places]
+        return {"results": result, "next_cursor": next_cursor}
 
     @place_api.doc('create a new place')
     @place_api.expect(place_model)
@@ -83,6 +93,8 @@ class PlaceList(Resource):
 
         if not data.get('host_id') or not data.get('city_id') or not data.get('name') or not data.get('number_of_rooms') or not data.get('number_of_bathrooms') or not data.get('price_per_night') or not data.get('max_guests'):
             place_api.abort(400, message='Invalid input')
+        if not valid_coordinates(data.get('latitude'), data.get('longitude')):
+            place_api.abort(400, message='Invalid latitude/longitude')
 
         user = User.query.filter_by(id=data['host_id']).first()
         city = City.query.filter_by(id=data['city_id']).first()
@@ -105,66 +117,201 @@ class PlaceList(Resource):
         db.session.add(new_place)
         db.session.commit()
 
-        return {
-            "id": new_place.id,
-            "host_id": new_place.host_id,
-            "city_id": new_place.city_id,
-            "name": new_place.name,
-            "description": new_place.description,
-            "address": new_place.address,
-            "latitude": new_place.latitude,
-            "longitude": new_place.longitude,
-            "number_of_rooms": new_place.number_of_rooms,
-            "number_of_bathrooms": new_place.number_of_bathrooms,
-            "price_per_night": new_place.price_per_night,
-            "max_guests": new_place.max_guests,
-            "created_at": new_place.created_at.strftime(Config.datetime_format),
-            "updated_at": new_place.updated_at.strftime(Config.datetime_format)
-        }, 201
+        return place_to_dict(new_place), 201
+
+
+PLACE_REQUIRED = ('host_id', 'city_id', 'name', 'number_of_rooms', 'number_of_bathrooms', 'price_per_night',
+                  'max_guests')
+
+
+@place_api.route('/bulk')
+class PlaceBulk(Resource):
+    @place_api.doc('create places in bulk')
+    @place_api.expect([place_model])
+    @place_api.response(201, 'All places created')
+    @place_api.response(207, 'Some places could not be created, see results')
+    @place_api.response(400, 'Invalid input')
+    def post(self):
+        """Create many places: one lookup per foreign key, batched inserts, one result per item"""
+        items = bulk_items(place_api)
+        result = BulkResult(len(items))
+
+        valid = []
+        for index, data in enumerate(items):
+            if not isinstance(data, dict) or not all(data.get(key) for key in PLACE_REQUIRED) \
+                    or not isinstance(data['host_id'], str) or not isinstance(data['city_id'], str):
+                result.fail(index, 400, 'Invalid input')
+            elif not valid_coordinates(data.get('latitude'), data.get('longitude')):
+                result.fail(index, 400, 'Invalid latitude/longitude')
+            else:
+                valid.append((index, data))
+
+        hosts = existing_values(User.id, [data['host_id'] for _, data in valid])
+        cities = existing_values(City.id, [data['city_id'] for _, data in valid])
+        pending = []
+        for index, data in valid:
+            if data['host_id'] not in hosts or data['city_id'] not in cities:
+                result.fail(index, 404, 'User or City not found')
+                continue
+            pending.append((index, Place(
+                host_id=data['host_id'],
+                city_id=data['city_id'],
+                name=data['name'],
+                number_of_rooms=data['number_of_rooms'],
+                number_of_bathrooms=data['number_of_bathrooms'],
+                price_per_night=data['price_per_night'],
+                max_guests=data['max_guests'],
+                description=data.get('description', ''),
+                address=data.get('address', ''),
+                latitude=data.get('latitude'),
+                longitude=data.get('longitude')
+            )))
+
+        insert_chunks(Place, pending, result)
+        return result.response()
+
+
+"""Sort orders accepted by /search, as keyset pagination keys"""
+SEARCH_SORTS = {
+    'newest': lambda: [(Place.created_at, True), (Place.id, True)],
+    'price_asc': lambda: [(Place.price_per_night, False), (Place.id, False)],
+    'price_desc': lambda: [(Place.price_per_night, True), (Place.id, True)],
+}
+
+
+def int_arg(name):
+    """Read an optional integer query parameter, aborting with 400 if it is malformed"""
+    return number_arg(name, int, 'an integer')
+
+
+def number_arg(name, cast=float, kind='a number'):
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return cast(value)
+    except ValueError:
+        place_api.abort(400, message='{} must be {}'.format(name, kind))
+
+
+@place_api.route('/search')
+class PlaceSearch(Resource):
+    @place_api.doc('search_places', params={
+        'city_id': 'Only places in this city',
+        'min_price': 'Minimum price per night',
+        'max_price': 'Maximum price per night',
+        'min_guests': 'Places that accept at least this many guests',
+        'number_of_rooms': 'Exact number of rooms',
+        'amenities': 'Comma-separated amenity ids the places must have',
+        'amenity_match': 'all (default) or any of the amenities',
+        'sort': 'One of {}'.format(', '.join(SEARCH_SORTS)),
+        'limit': 'Page size',
+        'cursor': 'next_cursor of the previous page',
+        'fields': 'Comma-separated keys to return'})
+    @place_api.response(400, 'Invalid input')
+    def get(self):
+        """Search live places; every filter is served by the composite indexes on places"""
+        sort = request.args.get('sort', 'newest')
+        if sort not in SEARCH_SORTS:
+            place_api.abort(400, message='sort must be one of {}'.format(', '.join(SEARCH_SORTS)))
+        keys = SEARCH_SORTS[sort]()
+        serialize, options = sparse_fields(place_api, place_detail, keys)
+
+        query = place_parents(Place.query).options(*options)
+        city_id = request.args.get('city_id')
+        if city_id:
+            query = query.filter(Place.city_id == city_id)
+        min_price = int_arg('min_price')
+        if min_price is not None:
+            query = query.filter(Place.price_per_night >= min_price)
+        max_price = int_arg('max_price')
+        if max_price is not None:
+            query = query.filter(Place.price_per_night <= max_price)
+        min_guests = int_arg('min_guests')
+        if min_guests is not None:
+            query = query.filter(Place.max_guests >= min_guests)
+        number_of_rooms = int_arg('number_of_rooms')
+        if number_of_rooms is not None:
+            query = query.filter(Place.number_of_rooms == number_of_rooms)
+        criterion = amenity_filter(place_api)
+        if criterion is not None:
+            query = query.filter(criterion)
+
+        places, next_cursor = paginate(place_api, query, keys)
+        return {"results": [serialize(place) for place in places], "next_cursor": next_cursor}
+
+
+@place_api.route('/nearby')
+class PlaceNearby(Resource):
+    @place_api.doc('nearby_places', params={
+        'lat': 'Latitude of the search centre',
+        'lon': 'Longitude of the search centre',
+        'radius_km': 'Search radius in kilometres',
+        'limit': 'Maximum number of places',
+        'fields': 'Comma-separated keys to return'})
+    @place_api.response(400, 'Invalid input')
+    def get(self):
+        """Live places within radius_km of (lat, lon), nearest first"""
+        lat = number_arg('lat')
+        lon = number_arg('lon')
+        if lat is None or lon is None or not valid_coordinates(lat, lon):
+            place_api.abort(400, message='lat and lon are required and must be valid coordinates')
+        radius_km = number_arg('radius_km')
+        if radius_km is None:
+            radius_km = Config.NEARBY_DEFAULT_RADIUS_KM
+        if not 0 < radius_km <= Config.NEARBY_MAX_RADIUS_KM:
+            place_api.abort(400, message='radius_km must be between 0 and {}'.format(Config.NEARBY_MAX_RADIUS_KM))
+        try:
+            limit = parse_limit(request.args.get('limit', Config.PAGE_SIZE_DEFAULT))
+        except ValueError as e:
+            place_api.abort(400, message=str(e))
+        serialize, options = sparse_fields(place_api, place_detail)
+
+        """Narrow down with geohash range scans, reading only id and coordinates"""
+        cells = [and_(Place.geohash >= prefix, Place.geohash < prefix + '~')
+                 for prefix in covering_prefixes(lat, lon, radius_km)]
+        # Same joins as the full load below, so a place whose host, city or country is deleted is skipped here
+        candidates = place_parents(db.session.query(Place.id, Place.latitude, Place.longitude)) \
+            .filter(or_(*cells)).all()
+
+        """Exact distances for the candidates, then load the nearest ones in full"""
+        distances = {}
+        for place_id, place_lat, place_lon in candidates:
+            distance = haversine_km(lat, lon, place_lat, place_lon)
+            if distance <= radius_km:
+                distances[place_id] = distance
+        nearest = sorted(distances, key=distances.get)[:limit]
+        query = place_parents(Place.query).options(*options)
+        places = {place.id: place for place in query.filter(Place.id.in_(nearest)).all()} if nearest else {}
+
+        result = []
+        for place_id in nearest:
+            if place_id not in places:
+                # Deleted between the two queries
+                continue
+            item = serialize(places[place_id])
+            item['distance_km'] = round(distances[place_id], 3)
+            result.append(item)
+        return {"results": result}
 
 
 @place_api.route('/place/<string:place_id>')
 class PlaceById(Resource):
-    @place_api.doc('get_place')
+    @place_api.doc('get_place', params={'fields': 'Comma-separated keys to return'})
     def get(self, place_id):
         """Query the place by ID from the database"""
-        place = Place.query.filter_by(id=place_id).first()
+        version = db.session.execute(place_versions().where(Place.id == place_id)).first()
+        if version is None:
+            place_api.abort(404, message='Place not found!')
+        check_row(version)
+
+        serialize, options = sparse_fields(place_api, place_detail)
+        place = place_parents(Place.query).options(*options).filter(Place.id == place_id).first()
         if place is None:
             place_api.abort(404, message='Place not found!')
         else:
             """Convert the Place object to a dictionary"""
-            return {
-                "id": place.id,
-                "host_id": place.host_id,
-                "city_id": place.city_id,
-                "name": place.name,
-                "description": place.description,
-                "address": place.address,
-                "latitude": place.latitude,
-                "longitude": place.longitude,
-                "number_of_rooms": place.number_of_rooms,
-                "number_of_bathrooms": place.number_of_bathrooms,
-                "price_per_night": place.price_per_night,
-                "max_guests": place.max_guests,
-                "created_at": place.created_at.strftime(Config.datetime_format),
-                "updated_at": place.updated_at.strftime(Config.datetime_format),
-                "user": {
-                    "id": place.host.id,
-                    "first_name": place.host.first_name,
-                    "last_name": place.host.last_name,
-                    "email": place.host.email,
-                    "password": place.host.password,
-                    "created_at": place.host.created_at.strftime(Config.datetime_format),
-                    "updated_at": place.host.updated_at.strftime(Config.datetime_format),
-                },
-                "city": {
-                    "id": place.city.id,
-                    "name": place.city.name,
-                    "country_id": place.city.country_id,
-                    "created_at": place.city.created_at.strftime(Config.datetime_format),
-                    "updated_at": place.city.updated_at.strftime(Config.datetime_format),
-                }
-            }
+            return serialize(place)
 
     @place_api.doc('update_place')
     @place_api.expect(place_model)
@@ -190,6 +337,10 @@ class PlaceById(Resource):
             place.latitude = data['latitude']
         if 'longitude' in data:
             place.longitude = data['longitude']
+        if 'latitude' in data or 'longitude' in data:
+            if not valid_coordinates(place.latitude, place.longitude):
+                place_api.abort(400, 'Invalid latitude/longitude')
+            place.update_geohash()
         if 'number_of_rooms' in data:
             place.number_of_rooms = data['number_of_rooms']
         if 'number_of_bathrooms' in data:
@@ -202,42 +353,11 @@ class PlaceById(Resource):
         place.updated_at = datetime.now()
         db.session.commit()
 
-        return {
-            "id": place.id,
-            "host_id": place.host_id,
-            "city_id": place.city_id,
-            "name": place.name,
-            "description": place.description,
-            "address": place.address,
-            "latitude": place.latitude,
-            "longitude": place.longitude,
-            "number_of_rooms": place.number_of_rooms,
-            "number_of_bathrooms": place.number_of_bathrooms,
-            "price_per_night": place.price_per_night,
-            "max_guests": place.max_guests,
-            "created_at": place.created_at.strftime(Config.datetime_format),
-            "updated_at": place.updated_at.strftime(Config.datetime_format),
-            "user": {
-                "id": place.host.id,
-                "first_name": place.host.first_name,
-                "last_name": place.host.last_name,
-                "email": place.host.email,
-                "password": place.host.password,
-                "created_at": place.host.created_at.strftime(Config.datetime_format),
-                "updated_at": place.host.updated_at.strftime(Config.datetime_format),
-            },
-            "city": {
-                "id": place.city.id,
-                "name": place.city.name,
-                "country_id": place.city.country_id,
-                "created_at": place.city.created_at.strftime(Config.datetime_format),
-                "updated_at": place.city.updated_at.strftime(Config.datetime_format),
-            }
-        }, 200
+        return place_detail(place), 200
 
     @place_api.doc('delete_place')
     def delete(self, place_id):
-        place = Place.query.filter_by(id=place_id, is_deleted=0).first()
+        place = Place.query.filter_by(id=place_id).first()
         if place is None:
             return place_api.abort(404, 'Place not found')
         try:
@@ -251,49 +371,38 @@ class PlaceById(Resource):
 
 @place_api.route('/<string:place_id>/reviews')
 class PlaceReviews(Resource):
-    @place_api.doc('get_place_reviews')
+    @place_api.doc('get_place_reviews', params={'fields': 'Comma-separated keys to return',
+                                                'fields[user]': 'Keys of the nested author'})
     def get(self, place_id):
         """Retrieve all reviews for a specific place"""
-        place = Place.query.get(place_id)
-        if not place:
+        serialize, options = sparse_fields(place_api, review_with_user)
+        if not db.session.query(Place.id).filter_by(id=place_id).first():
             place_api.abort(404, 'Place not found')
 
-        reviews = place.reviews
-        result = []
-        for review in reviews:
-            if review.user.is_deleted == 0:
-                result.append({
-                    'id': review.id,
-                    'user_id': review.user_id,
-                    'user': {
-                        'id': review.reviewer.id,
-                        'first_name': review.reviewer.first_name,
-                        'last_name': review.reviewer.last_name,
-                        'email': review.reviewer.email
-                    },
-                    'comment': review.comment,
-                    'rating': review.rating,
-                    'created_at': review.created_at.strftime(Config.datetime_format),
-                    'updated_at': review.updated_at.strftime(Config.datetime_format)
-                })
-        return result
+        reviews = review_parents(Review.query).options(*options).filter(Review.place_id == place_id) \
+            .order_by(Review.created_at, Review.id).all()
+        return [serialize(review) for review in reviews]
 
     @place_api.doc('create_place_review')
     @place_api.expect(review_model)
     @place_api.response(201, 'Review created successfully')
+    @place_api.response(202, 'Review accepted, it is written shortly (write-behind mode)')
     @place_api.response(400, 'Invalid input')
     @place_api.response(404, 'User or Place not found')
+    @place_api.response(503, 'Too many reviews waiting to be written')
     def post(self, place_id):
         """Create a new review for a specific place"""
         data = request.get_json()
         if not data.get('user_id') or not data.get('comment') or not data.get('rating'):
             place_api.abort(400, 'Invalid input')
+        if not valid_rating(data['rating']):
+            place_api.abort(400, 'rating must be a number')
 
         place = Place.query.get(place_id)
         if not place:
             place_api.abort(404, 'Place not found')
 
-        user = User.query.filter_by(id=data['user_id'], is_deleted=0).first()
+        user = User.query.filter_by(id=data['user_id']).first()
         if not user:
             place_api.abort(404, 'User not found')
 
@@ -303,31 +412,68 @@ class PlaceReviews(Resource):
             comment=data['comment'],
             rating=data['rating']
         )
-        db.session.add(new_review)
-        db.session.commit()
+        status = save_review(place_api, new_review)
+
+        result = review_to_dict(new_review)
+        result['user'] = user_to_dict(place.host)
+        result['city'] = city_to_dict(place.city)
+        return result, status
+
+
+@place_api.route('/<string:place_id>/amenities')
+class PlaceAmenities(Resource):
+    @place_api.doc('get_place_amenities')
+    @place_api.response(404, 'Place not found')
+    def get(self, place_id):
+        """The amenities of a place"""
+        if not db.session.query(Place.id).filter_by(id=place_id).first():
+            place_api.abort(404, 'Place not found')
+        amenities = Amenity.query.join(place_amenities, place_amenities.c.amenity_id == Amenity.id) \
+            .filter(place_amenities.c.place_id == place_id).order_by(Amenity.created_at, Amenity.id).all()
+        return [amenity_to_dict(amenity) for amenity in amenities]
 
-        return {
-            'id': new_review.id,
-            'user_id': new_review.user_id,
-            'place_id': new_review.place_id,
-            'comment': new_review.comment,
-            'rating': new_review.rating,
-            'created_at': new_review.created_at.strftime(Config.datetime_format),
-            'updated_at': new_review.updated_at.strftime(Config.datetime_format),
-            "user": {
-                "id": place.host.id,
-                "first_name": place.host.first_name,
-                "last_name": place.host.last_name,
-                "email": place.host.email,
-                "password": place.host.password,
-                "created_at": place.host.created_at.strftime(Config.datetime_format),
-                "updated_at": place.host.updated_at.strftime(Config.datetime_format),
-            },
-            "city": {
-                "id": place.city.id,
-                "name": place.city.name,
-                "country_id": place.city.country_id,
-                "created_at": place.city.created_at.strftime(Config.datetime_format),
-                "updated_at": place.city.updated_at.strftime(Config.datetime_format),
-            }
-        }, 201
\ No newline at end of file
+
+@place_api.route('/<string:place_id>/amenities/<string:amenity_id>')
+class PlaceAmenity(Resource):
+    def find(self, place_id, amenity_id):
+        place = db.session.query(Place.id).filter_by(id=place_id).first()
+        amenity = Amenity.query.filter_by(id=amenity_id).first()
+        if not place or not amenity:
+            place_api.abort(404, 'Place or Amenity not found')
+        attached = db.session.query(place_amenities.c.place_id).filter(
+            place_amenities.c.place_id == place_id, place_amenities.c.amenity_id == amenity_id).first()
+        return amenity, attached is not None
+
+    @place_api.doc('attach_amenity')
+    @place_api.response(201, 'Amenity attached')
+    @place_api.response(200, 'The place already had the amenity')
+    @place_api.response(404, 'Place or Amenity not found')
+    def put(self, place_id, amenity_id):
+        """Give a place an amenity"""
+        amenity, attached = self.find(place_id, amenity_id)
+        if attached:
+            return amenity_to_dict(amenity), 200
+        try:
+            db.session.execute(place_amenities.insert().values(place_id=place_id, amenity_id=amenity.id,
+                                                                created_at=datetime.now()))
+            Place.set_amenity_bit(place_id, amenity.bit, True)
+            db.session.commit()
+        except IntegrityError:
+            # Attached by a concurrent request in the meantime
+            db.session.rollback()
+            return amenity_to_dict(amenity), 200
+        return amenity_to_dict(amenity), 201
+
+    @place_api.doc('detach_amenity')
+    @place_api.response(200, 'Amenity detached')
+    @place_api.response(404, 'Place or Amenity not found, or the place does not have it')
+    def delete(self, place_id, amenity_id):
+        """Take an amenity away from a place"""
+        amenity, attached = self.find(place_id, amenity_id)
+        if not attached:
+            place_api.abort(404, 'The place does not have this amenity')
+        db.session.execute(place_amenities.delete().where(place_amenities.c.place_id == place_id,
+                                                          place_amenities.c.amenity_id == amenity.id))
+        Place.set_amenity_bit(place_id, amenity.bit, False)
+        db.session.commit()
+        return "delete successfully", 200
@@ -0,0 +1,145 @@
+"""Per-request SQL statement counting and timing.
+
+Every statement sent through any engine bumps a counter on ``flask.g`` so the
+number of queries a request needed can be logged, which is how N+1 loading
+patterns show up.
+
+With ``REQUEST_TIMING`` on, each request is also split into SQL time (engine
+events), handler time (ORM hydration and dict building, i.e. the view minus
+its SQL) and JSON encoding time (the restx representation), reported in a
+``Server-Timing`` header and one JSON log line. Requests slower than
+``SLOW_REQUEST_MS`` are sampled at ``SLOW_REQUEST_SAMPLE_RATE`` and logged
+with the full text of their queries.
+"""
+import json
+import logging
+import random
+import time
+from functools import wraps
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Longest parameter repr kept per sampled query; executemany batches can be huge
+PARAMETERS_LIMIT = 500
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _end_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    if has_request_context() and 'request_started' in g:
+        elapsed = time.perf_counter() - started
+        g.sql_time += elapsed
+        g.queries.append((statement, parameters, elapsed))
+
+
+def _fail_query(context):
+    # A failed statement never reaches after_cursor_execute, so drop its start here
+    if context.connection is not None:
+        started = context.connection.info.get('query_started')
+        if started:
+            started.pop()
+
+
+def timed_representation(represent):
+    """Wrap a restx representation function so its encoding time is added to the request"""
+    @wraps(represent)
+    def timed(data, code, headers=None):
+        started = time.perf_counter()
+        response = represent(data, code, headers)
+        if has_request_context() and 'request_started' in g:
+            g.encode_time += time.perf_counter() - started
+        return response
+    return timed
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+def init_query_log(app, api):
+    event.listen(Engine, 'before_cursor_execute', _count_query)
+
+    if app.config.get('LOG_QUERY_COUNTS') or app.config.get('REQUEST_TIMING'):
+        app.logger.setLevel(logging.INFO)
+
+    if app.config.get('REQUEST_TIMING'):
+        init_request_timing(app, api)
+    elif app.config.get('LOG_QUERY_COUNTS'):
+        @app.after_request
+        def log_query_count(response):
+            app.logger.info('%s %s -> %d SQL queries', request.method, request.full_path.rstrip('?'),
+                            g.get('query_count', 0))
+            return response
+
+
+def init_request_timing(app, api):
+    event.listen(Engine, 'before_cursor_execute', _start_query)
+    event.listen(Engine, 'after_cursor_execute', _end_query)
+    event.listen(Engine, 'handle_error', _fail_query)
+    for mediatype, represent in list(api.representations.items()):
+        api.representations[mediatype] = timed_representation(represent)
+
+    slow_ms = app.config.get('SLOW_REQUEST_MS', 500)
+    sample_rate = app.config.get('SLOW_REQUEST_SAMPLE_RATE', 1.0)
+
+    @app.before_request
+    def start_timing():
+        g.request_started = time.perf_counter()
+        g.sql_time = 0.0
+        g.encode_time = 0.0
+        g.queries = []
+
+    def log_timing(state, record, total):
+        record.update(
+            total_ms=_ms(total),
+            sql_ms=_ms(state.sql_time),
+            sql_count=state.get('query_count', 0),
+            handler_ms=_ms(max(total - state.sql_time - state.encode_time, 0.0)),
+            encode_ms=_ms(state.encode_time),
+        )
+        if total * 1000 >= slow_ms and random.random() < sample_rate:
+            record['queries'] = [
+                {'sql': statement, 'parameters': repr(parameters)[:PARAMETERS_LIMIT], 'ms': _ms(elapsed)}
+                for statement, parameters, elapsed in state.queries]
+            app.logger.warning('slow request %s', json.dumps(record))
+        else:
+            app.logger.info('request %s', json.dumps(record))
+
+    @app.after_request
+    def report_timing(response):
+        if 'request_started' not in g:
+            return response
+        total = time.perf_counter() - g.request_started
+        handler = max(total - g.sql_time - g.encode_time, 0.0)
+        response.headers['Server-Timing'] = ', '.join([
+            'sql;dur=%.3f;desc="%d queries"' % (g.sql_time * 1000, g.get('query_count', 0)),
+            'handler;dur=%.3f' % (handler * 1000),
+            'encode;dur=%.3f' % (g.encode_time * 1000),
+            'total;dur=%.3f' % (total * 1000),
+        ])
+
+        record = {
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+        }
+        if response.is_streamed:
+            # The body and its SQL are produced after this hook (stream_with_context keeps g
+            # alive meanwhile), so the log line is written once the stream has been sent
+            record['streamed'] = True
+            state = g._get_current_object()
+            response.call_on_close(lambda: log_timing(state, record, time.perf_counter() - state.request_started))
+        else:
+            log_timing(g, record, total)
+        return response
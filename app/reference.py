@@ -0,0 +1,194 @@
+"""Immutable in-memory snapshot of the country -> city hierarchy.
+
+The country/city read endpoints (``CityList``, ``CountriesByCode`` and both
+``CountryCities``) are served from a ``Snapshot`` of every live country and city and make no
+database round trip. A snapshot is never modified after it is built. A
+rebuild loads a complete new one and replaces the reference in a single
+assignment, so a request sees either the old tree or the new one, never a
+mixture.
+
+A daemon thread checks every SNAPSHOT_POLL_INTERVAL seconds whether the
+tables changed, comparing ``max(updated_at)`` and the live row count of
+each table (two aggregate queries), and rebuilds when they did. A city
+write in this process patches the written city into a copy of the current
+snapshot, so the writer reads its own change without reloading the tree,
+and wakes the poller to reload it in the background. Other worker
+processes catch up at their next poll.
+"""
+import bisect
+import os
+import threading
+
+from sqlalchemy import func, select
+
+from app import app, db
+from app.pagination import decode_cursor, default_keys, split_page
+from config import Config
+from models.city import City
+from models.country import Country
+
+_MISSING = object()
+
+
+class CountryRow(object):
+    __slots__ = ('id', 'name', 'code', 'created_at', 'updated_at')
+
+    def __init__(self, id, name, code, created_at, updated_at):
+        self.id = id
+        self.name = name
+        self.code = code
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+
+class CityRow(object):
+    """A city with its country attached, readable by the City serializers"""
+    __slots__ = ('id', 'name', 'country_id', 'country', 'created_at', 'updated_at')
+
+    def __init__(self, id, name, country_id, country, created_at, updated_at):
+        self.id = id
+        self.name = name
+        self.country_id = country_id
+        self.country = country
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+
+class Snapshot(object):
+    """Live countries by code and id, and their cities in ``(created_at, id)`` order"""
+
+    def __init__(self, stamp, countries, cities):
+        self.stamp = stamp
+        self.countries_by_id = {country.id: country for country in countries}
+        self.countries_by_code = {}
+        for country in countries:
+            self.countries_by_code.setdefault(country.code, country)
+
+        self.cities = []
+        self.cities_by_country = {country.id: [] for country in countries}
+        for city in sorted(cities, key=lambda city: (city.created_at, city.id)):
+            country = self.countries_by_id.get(city.country_id)
+            if country is None:
+                # Like the inner-joined ORM loads, a city of a deleted country is not shown
+                continue
+            row = CityRow(city.id, city.name, city.country_id, country, city.created_at, city.updated_at)
+            self.cities.append(row)
+            self.cities_by_country[country.id].append(row)
+        self._city_keys = [(city.created_at, city.id) for city in self.cities]
+        self._serialized = {}
+
+    def city_page(self, limit, cursor=None):
+        """``(cities, next_cursor)`` like ``pagination.paginate``; ValueError for a bad cursor"""
+        start = 0
+        if cursor:
+            try:
+                start = bisect.bisect_right(self._city_keys, tuple(decode_cursor(cursor, 2)))
+            except TypeError:
+                # Well-formed cursor holding values of the wrong types
+                raise ValueError('Invalid cursor')
+        return split_page(self.cities[start:start + limit + 1], default_keys(City), limit)
+
+    def country_cities(self, code, serialize):
+        """The cities of the country with this ``code`` passed through ``serialize``, or None if it does not exist.
+
+        The list is built once per snapshot and serializer and shared, so callers must not modify it.
+        """
+        country = self.countries_by_code.get(code)
+        if country is None:
+            return None
+        key = (country.id, serialize)
+        result = self._serialized.get(key, _MISSING)
+        if result is _MISSING:
+            result = self._serialized[key] = [serialize(city) for city in self.cities_by_country[country.id]]
+        return result
+
+
+def _stamp():
+    """What changes whenever a live country or city is added, edited or removed"""
+    countries = db.session.execute(select(func.max(Country.updated_at), func.count()).select_from(Country)).one()
+    cities = db.session.execute(select(func.max(City.updated_at), func.count()).select_from(City)).one()
+    return tuple(countries) + tuple(cities)
+
+
+class ReferenceIndex(object):
+    def __init__(self, interval):
+        self.interval = interval
+        self.rebuilds = 0
+        self.patches = 0
+        self._snapshot = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def current(self):
+        """The latest snapshot; the first call in a process builds it and starts the poller"""
+        snapshot = self._snapshot
+        if snapshot is None or self._pid != os.getpid():
+            with self._lock:
+                if self._snapshot is None or self._pid != os.getpid():
+                    self._load()
+                    self._pid = os.getpid()
+                    threading.Thread(target=self._poll, name='reference-index', daemon=True).start()
+                snapshot = self._snapshot
+        return snapshot
+
+    def rebuild(self):
+        """Reload the whole tree now"""
+        with self._lock:
+            self._load()
+
+    def patch_city(self, city=None, removed_id=None):
+        """After a city write in this process: put ``city`` (or drop ``removed_id``) into the snapshot.
+
+        The patched copy keeps the old stamp, so the poller, which this wakes
+        up, still sees the tables as changed and reloads them in the background.
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None:
+                dropped = city.id if city is not None else removed_id
+                cities = [row for row in snapshot.cities if row.id != dropped]
+                if city is not None:
+                    cities.append(city)
+                self._snapshot = Snapshot(snapshot.stamp, list(snapshot.countries_by_id.values()), cities)
+                self.patches += 1
+        self._wake.set()
+
+    def _load(self):
+        # A context of its own: callers may be the poller, the event loop or a request mid-transaction
+        with app.app_context():
+            # Stamp first: a change that lands while the rows are read shows up at the next poll
+            stamp = _stamp()
+            countries = db.session.execute(
+                select(Country.id, Country.name, Country.code, Country.created_at, Country.updated_at)
+                .order_by(Country.created_at, Country.id)).all()
+            cities = db.session.execute(
+                select(City.id, City.name, City.country_id, City.created_at, City.updated_at)).all()
+        self._snapshot = Snapshot(stamp, [CountryRow(*row) for row in countries], cities)
+        self.rebuilds += 1
+
+    def _poll(self):
+        while True:
+            # A write wakes the poller early; with an interval of 0 only writes do
+            self._wake.wait(self.interval if self.interval > 0 else None)
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    changed = _stamp() != self._snapshot.stamp
+                if changed:
+                    self.rebuild()
+            except Exception:
+                app.logger.exception('reference index refresh failed')
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "countries": len(snapshot.countries_by_id) if snapshot else 0,
+            "cities": len(snapshot.cities) if snapshot else 0,
+            "rebuilds": self.rebuilds,
+            "patches": self.patches,
+            "poll_interval": self.interval,
+        }
+
+
+reference_index = ReferenceIndex(Config.SNAPSHOT_POLL_INTERVAL)
@@ -0,0 +1,108 @@
+"""Read-replica routing: GET traffic reads from replicas, writes go to the primary.
+
+Each replica in DATABASE_REPLICA_URLS is a Flask-SQLAlchemy bind
+(``replica_0``, ``replica_1``, ...). A GET or HEAD request is given one of
+them, taken round-robin, when it starts, and ``RoutingSession`` sends the
+request's reads there. Flushes, UPDATE/DELETE/INSERT statements and every
+non-GET request use the primary, and so does anything running outside a
+request (CLI commands, the write-behind worker, the country/city snapshot).
+
+Replicas lag behind the primary, so a client that has just written would
+not see its own change. A successful write therefore sets a short-lived
+cookie and the client's requests go to the primary until it expires
+(REPLICA_STICKY_SECONDS).
+
+Replica connections are opened read-only (``PRAGMA query_only`` on SQLite,
+``transaction_read_only`` on MySQL), so a write that is routed to a replica
+by mistake fails instead of diverging from the primary.
+"""
+import itertools
+import math
+import threading
+import time
+
+from flask import g, has_app_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+
+from config import Config
+
+STICKY_COOKIE = 'hbnb_primary'
+
+"""Methods whose requests may read from a replica"""
+READ_METHODS = ('GET', 'HEAD')
+
+_replicas = itertools.cycle(sorted(Config.SQLALCHEMY_BINDS))
+_lock = threading.Lock()
+
+
+def next_replica():
+    with _lock:
+        return next(_replicas)
+
+
+def stuck_to_primary(cookies):
+    """Whether the client wrote recently enough that it must read from the primary"""
+    try:
+        return float(cookies.get(STICKY_COOKIE) or 0) > time.time()
+    except ValueError:
+        return False
+
+
+def choose_bind(method, cookies):
+    """The replica bind key a request with this method and these cookies reads from, or None for the primary"""
+    bind = None
+    if Config.REPLICA_URIS and method in READ_METHODS and not stuck_to_primary(cookies):
+        bind = next_replica()
+    # Imported here: app.metrics needs the db this module is imported to build
+    from app.metrics import request_routed
+    request_routed(bind)
+    return bind
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy's session, reading from the replica chosen for the current request"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not isinstance(clause, UpdateBase) and has_app_context():
+            replica = g.get('db_replica')
+            if replica is not None:
+                return self._db.engines[replica]
+        return super(RoutingSession, self).get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def make_read_only(engine):
+    """Have every new connection of ``engine`` (a sync Engine) refuse writes"""
+    dialect = engine.dialect.name
+    if dialect == 'sqlite':
+        statement = 'PRAGMA query_only = ON'
+    elif dialect == 'mysql':
+        statement = 'SET SESSION transaction_read_only = 1'
+    else:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def read_only(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(statement)
+        cursor.close()
+
+
+def init_replicas(app, db):
+    if not Config.REPLICA_URIS:
+        return
+    with app.app_context():
+        for key in Config.SQLALCHEMY_BINDS:
+            make_read_only(db.engines[key])
+
+    @app.before_request
+    def route_reads():
+        g.db_replica = choose_bind(request.method, request.cookies)
+
+    @app.after_request
+    def stick_to_primary(response):
+        if request.method not in READ_METHODS and response.status_code < 300 and Config.REPLICA_STICKY_SECONDS > 0:
+            response.set_cookie(STICKY_COOKIE, '%.3f' % (time.time() + Config.REPLICA_STICKY_SECONDS),
+                                max_age=math.ceil(Config.REPLICA_STICKY_SECONDS), httponly=True, samesite='Lax')
+        return response
@@ -3,12 +3,20 @@ from datetime import datetime
 
 from flask import request
 from flask_restx import Resource, fields
+from sqlalchemy import select, update
 
 from app import review_api, db, place_api
 from config import Config
 from models.review import Review
 from models.user import User
 from models.place import Place
+from app.pagination import paginate, default_keys
+from app.parents import review_parents
+from app.streaming import wants_stream, stream_query
+from app.fieldsets import sparse_fields
+from app.serializers import review_to_dict, review_detail
+from app.bulk import BulkResult, bulk_items, existing_values, insert_chunks
+from app.write_behind import QueueFull, WriteBehindQueue
 
 """Define the Review model for the API documentation"""
 review_model = review_api.model('Review', {
@@ -19,54 +27,79 @@ review_model = review_api.model('Review', {
 })
 
 
+def valid_rating(rating):
+    return isinstance(rating, (int, float)) and not isinstance(rating, bool)
+
+
+def review_versions():
+    """updated_at of each review and of the author and place nested in its response"""
+    return review_parents(select(Review.updated_at, User.updated_at, Place.updated_at))
+
+
+def add_to_place_ratings(reviews):
+    """Fold newly inserted reviews into their places' aggregates, one executemany for all places"""
+    totals = {}
+    for review in reviews:
+        count, rating_sum = totals.get(review.place_id, (0, 0))
+        totals[review.place_id] = (count + 1, rating_sum + review.rating)
+    Place.adjust_ratings(totals)
+
+
+"""New reviews waiting for a group commit when Config.REVIEW_WRITE_BEHIND is on"""
+review_queue = WriteBehindQueue(Review, Config.REVIEW_QUEUE_SIZE, Config.REVIEW_BATCH_SIZE,
+                                Config.REVIEW_BATCH_DELAY_MS / 1000.0, Config.REVIEW_QUEUE_TIMEOUT,
+                                Config.REVIEW_FLUSH_TIMEOUT, after_chunk=add_to_place_ratings)
+
+
+def save_review(namespace, review):
+    """Insert ``review`` now and return 201, or queue it for the write-behind worker and return 202"""
+    if not Config.REVIEW_WRITE_BEHIND:
+        db.session.add(review)
+        Place.adjust_rating(review.place_id, review.rating)
+        db.session.commit()
+        return 201
+    try:
+        review_queue.submit(review)
+    except QueueFull:
+        namespace.abort(503, message='Server busy, please retry')
+    return 202
+
+
 @review_api.route("")
 class ReviewList(Resource):
-    @review_api.doc("get all reviews")
+    @review_api.doc("get all reviews", params={'limit': 'Page size', 'cursor': 'next_cursor of the previous page',
+                                               'stream': 'Set to 1 to stream every review as NDJSON',
+                                               'fields': 'Comma-separated keys to return',
+                                               'fields[user]': 'Keys of the nested author',
+                                               'fields[place]': 'Keys of the nested place'})
     def get(self):
-        """Query all reviews from the database"""
-        reviews = Review.query.all()
-        result = []
-        """Convert each Review object to a dictionary"""
-        for review in reviews:
-            if review.user.is_deleted == 0 and review.place.is_deleted == 0:
-                result.append({
-                    "id": review.id,
-                    "user_id": review.user_id,
-                    "user": {
-                        "id": review.user.id,
-                        "first_name": review.user.first_name,
-                        "last_name": review.user.last_name,
-                        "email": review.user.email
-                    },
-                    "place_id": review.place_id,
-                    "place": {
-                        "id": review.place.id,
-                        "name": review.place.name,
-                        "city_id": review.place.city_id,
-                        "address": review.place.address,
-                        "price_per_night": review.place.price_per_night
-                    },
-                    "comment": review.comment,
-                    "rating": review.rating,
-                    "created_at": review.created_at.strftime(Config.datetime_format),
-                    "updated_at": review.updated_at.strftime(Config.datetime_format)
-                })
-        return result
+        """Query one page of reviews from the database, or stream all of them"""
+        serialize, options = sparse_fields(review_api, review_detail, default_keys(Review))
+        query = review_parents(Review.query).options(*options)
+        if wants_stream():
+            return stream_query(query.order_by(Review.created_at, Review.id), serialize)
+
+        reviews, next_cursor = paginate(review_api, query, default_keys(Review), versions=review_versions())
+        return {"results": [serialize(review) for review in reviews], "next_cursor": next_cursor}
 
     @review_api.doc('create a new review')
     @review_api.expect(review_model)
     @review_api.response(201, 'Review created successfully')
+    @review_api.response(202, 'Review accepted, it is written shortly (write-behind mode)')
     @review_api.response(400, 'Invalid input')
     @review_api.response(404, 'User or Place not found')
+    @review_api.response(503, 'Too many reviews waiting to be written')
     def post(self):
         """Create a new review"""
         data = request.get_json()
 
         if not data.get('user_id') or not data.get('place_id') or not data.get('comment') or not data.get('rating'):
             review_api.abort(400, message='Invalid input')
+        if not valid_rating(data['rating']):
+            review_api.abort(400, message='rating must be a number')
 
-        user = User.query.filter_by(id=data['user_id'], is_deleted=0).first()
-        place = Place.query.filter_by(id=data['place_id'], is_deleted=0).first()
+        user = User.query.filter_by(id=data['user_id']).first()
+        place = Place.query.filter_by(id=data['place_id']).first()
         if not user or not place:
             review_api.abort(400, message='User or Place not found')
 
@@ -76,50 +109,79 @@ class ReviewList(Resource):
             comment=data['comment'],
             rating=data['rating']
         )
-        db.session.add(new_review)
-        db.session.commit()
+        status = save_review(review_api, new_review)
+        return review_to_dict(new_review), status
 
-        return {
-            "id": new_review.id,
-            "user_id": new_review.user_id,
-            "place_id": new_review.place_id,
-            "comment": new_review.comment,
-            "rating": new_review.rating,
-            "created_at": new_review.created_at.strftime(Config.datetime_format),
-            "updated_at": new_review.updated_at.strftime(Config.datetime_format)
-        }, 201
-
-    @place_api.doc('create_place_review')
-    @place_api.expect(review_model)
-    @place_api.response(201, 'Review created successfully')
-    @place_api.response(400, 'Invalid input')
-    def post(self, place_id):
-        """Create a new review for a specific place"""
-        data = request.get_json()
-        if not data.get('user_id') or not data.get('place_id') or not data.get('comment') or not data.get('rating'):
-            place_api.abort(400, 'Invalid input')
 
-        user = User.query.filter_by(id=data['user_id'], is_deleted=0).first()
+@review_api.route('/bulk')
+class ReviewBulk(Resource):
+    @review_api.doc('create reviews in bulk')
+    @review_api.expect([review_model])
+    @review_api.response(201, 'All reviews created')
+    @review_api.response(207, 'Some reviews could not be created, see results')
+    @review_api.response(400, 'Invalid input')
+    def post(self):
+        """Create many reviews: one lookup per foreign key, batched inserts, one result per item"""
+        items = bulk_items(review_api)
+        result = BulkResult(len(items))
 
-        place = Place.query.filter_by(id=data['place_id'], is_deleted=0).first()
-        if not user or not place:
-            review_api.abort(404, message='User or Place not found')
+        valid = []
+        for index, data in enumerate(items):
+            if not isinstance(data, dict) or not data.get('user_id') or not data.get('place_id') \
+                    or not data.get('comment') or not data.get('rating'):
+                result.fail(index, 400, 'Invalid input')
+            elif not isinstance(data['user_id'], str) or not isinstance(data['place_id'], str):
+                result.fail(index, 400, 'Invalid input')
+            elif not valid_rating(data['rating']):
+                result.fail(index, 400, 'rating must be a number')
+            else:
+                valid.append((index, data))
 
-        new_review = Review(
-            user_id=data['user_id'],
-            place_id=data['place_id'],
-            comment=data['comment'],
-            rating=data['rating']
-        )
-        db.session.add(new_review)
-        db.session.commit()
+        users = existing_values(User.id, [data['user_id'] for _, data in valid])
+        places = existing_values(Place.id, [data['place_id'] for _, data in valid])
+        pending = []
+        for index, data in valid:
+            if data['user_id'] not in users or data['place_id'] not in places:
+                result.fail(index, 404, 'User or Place not found')
+                continue
+            pending.append((index, Review(user_id=data['user_id'], place_id=data['place_id'],
+                                          comment=data['comment'], rating=data['rating'])))
+
+        insert_chunks(Review, pending, result, after_chunk=add_to_place_ratings)
+        return result.response()
+
+
+@review_api.route('/<string:review_id>')
+@review_api.param('review_id', 'The review identifier')
+class ReviewById(Resource):
+    @review_api.doc('get_review', params={'fields': 'Comma-separated keys to return'})
+    @review_api.response(404, 'Review not found')
+    def get(self, review_id):
+        serialize, options = sparse_fields(review_api, review_detail)
+        review = review_parents(Review.query).options(*options).filter(Review.id == review_id).first()
+        if review is None:
+            review_api.abort(404, message='Review not found')
+        return serialize(review)
 
-        return {
-            'id': new_review.id,
-            'user_id': new_review.user_id,
-            'place_id': new_review.place_id,
-            'comment': new_review.comment,
-            'rating': new_review.rating,
-            'created_at': new_review.created_at.strftime(Config.datetime_format),
-            'updated_at': new_review.updated_at.strftime(Config.datetime_format)
-        },
\ No newline at end of file
+    @review_api.doc('delete_review')
+    @review_api.response(404, 'Review not found')
+    def delete(self, review_id):
+        """Soft-delete a review and take it out of its place's rating aggregates"""
+        review = Review.query.filter_by(id=review_id).first()
+        if review is None:
+            return review_api.abort(404, 'Review not found')
+        try:
+            # Conditional, so of two concurrent deletes only one takes the review out of the aggregates
+            deleted = db.session.execute(
+                update(Review).where(Review.id == review.id, Review.is_deleted == 0)
+                .values(is_deleted=1, updated_at=datetime.now())
+                .execution_options(synchronize_session=False)).rowcount
+            if deleted == 1:
+                Place.adjust_rating(review.place_id, -review.rating, count=-1)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            review_api.abort(500, message='An error occurred while deleting the review')
+        if deleted != 1:
+            review_api.abort(404, 'Review not found')
+        return "delete successfully", 200
@@ -0,0 +1,152 @@
+"""Precompiled serializers that turn model objects into response dictionaries.
+
+Each serializer is generated once at import time as a plain function whose
+body is a single dict literal, e.g.::
+
+    def place_brief(obj):
+        if obj is None:
+            return None
+        return {'id': obj.id, 'name': obj.name, ...}
+
+so serializing a row costs attribute loads and nothing else. DateTime
+columns are detected from the model's table and formatted inline; when
+``Config.datetime_format`` is the default ISO layout the much faster
+``datetime.isoformat`` is used instead of ``strftime``.
+
+A field spec is a list whose items are one of:
+
+* ``'name'`` - a column (or attribute) of the model;
+* ``('key', 'attr.path')`` - a dotted attribute path, e.g. ``'country.code'``;
+* ``('key', serializer, 'relationship')`` - a nested serializer.
+
+Each serializer keeps its ``model`` and ``fields`` so that
+``sparse_serializer`` can compile a variant restricted to the keys a client
+asked for with ``?fields=`` (see ``app.fieldsets``).
+"""
+from functools import lru_cache
+
+from sqlalchemy import DateTime
+
+from config import Config
+from models.amenity import Amenity
+from models.city import City
+from models.country import Country
+from models.place import Place
+from models.review import Review
+from models.user import User
+
+ISO_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+# Fields that are Python properties, and the columns they are computed from
+DEPENDS_ON = {
+    (Place, 'average_rating'): ('review_count', 'rating_sum'),
+}
+
+
+def _datetime_expr(expr):
+    if Config.datetime_format == ISO_FORMAT:
+        return "%s.isoformat(timespec='microseconds')" % expr
+    return "%s.strftime(_datetime_format)" % expr
+
+
+def _attr_expr(path):
+    parts = path.split('.')
+    for part in parts:
+        if not part.isidentifier():
+            raise ValueError('Invalid attribute path %r' % path)
+    return 'obj.' + '.'.join(parts)
+
+
+def compile_serializer(model, fields, name=None):
+    """Generate and return ``serialize(obj) -> dict`` for ``model``"""
+    name = name or model.__name__.lower()
+    columns = model.__table__.c
+    namespace = {'_datetime_format': Config.datetime_format}
+    items = []
+    for field in fields:
+        if isinstance(field, str):
+            expr = _attr_expr(field)
+            if field in columns and isinstance(columns[field].type, DateTime):
+                expr = _datetime_expr(expr)
+            items.append((field, expr))
+        elif len(field) == 2:
+            items.append((field[0], _attr_expr(field[1])))
+        else:
+            key, nested, attr = field
+            helper = '_nested_%d' % len(namespace)
+            namespace[helper] = nested
+            items.append((key, '%s(%s)' % (helper, _attr_expr(attr))))
+
+    source = 'def %s(obj):\n    if obj is None:\n        return None\n    return {\n' % name
+    source += ''.join('        %r: %s,\n' % item for item in items)
+    source += '    }\n'
+    exec(compile(source, '<serializer %s>' % name, 'exec'), namespace)
+    serializer = namespace[name]
+    serializer.source = source
+    serializer.model = model
+    serializer.fields = list(fields)
+    return serializer
+
+
+def field_key(field):
+    """The response key a field spec produces"""
+    return field if isinstance(field, str) else field[0]
+
+
+@lru_cache(maxsize=256)
+def sparse_serializer(serializer, keys=None, nested=()):
+    """``serializer`` restricted to the response ``keys`` (a frozenset, None for all of them).
+
+    ``nested`` is a tuple of ``(key, frozenset_of_keys)`` restricting nested
+    objects the same way. Variants are compiled once and cached.
+    """
+    nested = dict(nested)
+    fields = []
+    for field in serializer.fields:
+        key = field_key(field)
+        if keys is not None and key not in keys:
+            continue
+        if key in nested and len(field) == 3 and not isinstance(field, str):
+            field = (key, sparse_serializer(field[1], nested[key]), field[2])
+        fields.append(field)
+    return compile_serializer(serializer.model, fields, serializer.__name__ + '_sparse')
+
+
+user_to_dict = compile_serializer(User, ['id', 'first_name', 'last_name', 'email', 'created_at', 'updated_at'])
+
+user_brief = compile_serializer(User, ['id', 'first_name', 'last_name', 'email'], name='user_brief')
+
+country_to_dict = compile_serializer(Country, ['id', 'name', 'code', 'created_at', 'updated_at'])
+
+city_to_dict = compile_serializer(City, ['id', 'name', 'country_id', 'created_at', 'updated_at'])
+
+city_with_country_code = compile_serializer(City, [
+    'id', 'name', 'country_id', ('country_code', 'country.code'), 'created_at', 'updated_at'],
+    name='city_with_country_code')
+
+amenity_to_dict = compile_serializer(Amenity, ['id', 'name', 'created_at', 'updated_at'])
+
+place_to_dict = compile_serializer(Place, [
+    'id', 'host_id', 'city_id', 'name', 'description', 'address', 'latitude', 'longitude',
+    'number_of_rooms', 'number_of_bathrooms', 'price_per_night', 'max_guests', 'review_count', 'average_rating',
+    'created_at', 'updated_at'])
+
+place_detail = compile_serializer(Place, [
+    'id', 'host_id', 'city_id', 'name', 'description', 'address', 'latitude', 'longitude',
+    'number_of_rooms', 'number_of_bathrooms', 'price_per_night', 'max_guests', 'review_count', 'average_rating',
+    'created_at', 'updated_at',
+    ('user', user_to_dict, 'host'), ('city', city_to_dict, 'city')], name='place_detail')
+
+place_brief = compile_serializer(Place, ['id', 'name', 'city_id', 'address', 'price_per_night'],
+                                 name='place_brief')
+
+review_to_dict = compile_serializer(Review, [
+    'id', 'user_id', 'place_id', 'comment', 'rating', 'created_at', 'updated_at'])
+
+review_detail = compile_serializer(Review, [
+    'id', 'user_id', ('user', user_brief, 'user'), 'place_id', ('place', place_brief, 'place'),
+    'comment', 'rating', 'created_at', 'updated_at'], name='review_detail')
+
+review_with_user = compile_serializer(Review, [
+    'id', 'user_id', ('user', user_brief, 'user'), 'comment', 'rating', 'created_at', 'updated_at'],
+    name='review_with_user')
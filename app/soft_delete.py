@@ -0,0 +1,35 @@
+"""Soft-delete filtering applied to every ORM query.
+
+Models that mix in ``SoftDelete`` get the ``is_deleted`` column, and every
+ORM SELECT (entity and column queries, explicit joins, joined eager loads,
+subqueries and ``Query.get``) only sees rows with ``is_deleted = 0``. The
+read endpoints inner-join the parents they show (``app.parents``), so a
+row whose parent is deleted is dropped along with it: a review of a
+deleted user or place is not returned, and neither is a place whose host
+was deleted.
+
+Code that has to see deleted rows, such as reactivating an account or an
+admin view, opts out per query with ``include_deleted(query)``.
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import Session, with_loader_criteria
+
+from app import db
+
+
+class SoftDelete(object):
+    is_deleted = db.Column(db.Boolean, default=False, nullable=False, server_default='0')
+
+
+def include_deleted(query):
+    """Return ``query`` (a Query or Select) without the live-rows-only filter"""
+    return query.execution_options(include_deleted=True)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _only_live_rows(state):
+    # Column refreshes and relationship lazy loads inherit the criteria of the query that loaded the parent
+    if (state.is_select and not state.is_column_load and not state.is_relationship_load
+            and not state.execution_options.get('include_deleted', False)):
+        state.statement = state.statement.options(
+            with_loader_criteria(SoftDelete, lambda cls: cls.is_deleted == 0, include_aliases=True))
@@ -0,0 +1,30 @@
+"""Opt-in NDJSON streaming for large collection responses.
+
+Clients ask for it with ``Accept: application/x-ndjson`` or ``?stream=1``.
+Rows are read with ``yield_per`` (a server-side cursor on MySQL) and each
+serialized row is written to the socket as soon as it is built, so memory
+stays flat no matter how big the table is.
+"""
+from flask import Response, request, stream_with_context
+
+from app.encoding import dumps
+from config import Config
+
+NDJSON = 'application/x-ndjson'
+
+
+def wants_stream():
+    if request.args.get('stream') == '1':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON
+
+
+def stream_query(query, serialize):
+    """Stream ``query`` as one JSON document per line"""
+    rows = query.yield_per(Config.STREAM_BATCH_SIZE)
+
+    def generate():
+        for row in rows:
+            yield dumps(serialize(row))
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON)
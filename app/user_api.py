@@ -1,14 +1,21 @@
 import re
 from datetime import datetime
-from app import bcrypt
 
 from flask import request
 from flask_restx import Resource, fields
+from sqlalchemy.exc import IntegrityError
 
 from app import user_api, db
 from config import Config
 from models import place
-from models.user import User
+from models.user import User, normalize_email
+from app.pagination import paginate, default_keys
+from app.fieldsets import sparse_fields
+from app.serializers import user_to_dict
+from app.conditional import check_row
+from app.bulk import BulkResult, bulk_items, existing_values, insert_chunks
+from app.soft_delete import include_deleted
+from app.hashing import HashingBusy, check_password, hash_password, hash_passwords, needs_rehash
 
 """Define the User model for API documentation"""
 user_model = user_api.model('User', {
@@ -21,29 +28,29 @@ user_model = user_api.model('User', {
 
 """Function to validate email format"""
 def validate_email(email):
-    return re.match(r"[^@]+@[^@]+\.[^@]+", email)
+    return isinstance(email, str) and re.match(r"[^@]+@[^@]+\.[^@]+", email)
+
+
+def hash_or_abort(password):
+    if not isinstance(password, str):
+        user_api.abort(400, message='Invalid input')
+    try:
+        return hash_password(password)
+    except HashingBusy:
+        user_api.abort(503, message='Server busy, please retry')
 
 
 @user_api.route('/')
 class Users(Resource):
+    @user_api.doc('get all users', params={'limit': 'Page size', 'cursor': 'next_cursor of the previous page',
+                                           'fields': 'Comma-separated keys to return'})
     def get(self):
-        """Retrieve all User Model data"""
-        users = User.query.filter_by(is_deleted=0).all()
-        """Get the database query result list, which contains 
-        database objects and cannot be returned directly. 
-        Needs to be re-packaged."""
-        result = []
-        for row in users:
-            result.append({
-                "id": row.id,
-                "first_name": row.first_name,
-                "last_name": row.last_name,
-                "email": row.email,
-                "password": row.password,
-                "created_at": row.created_at.strftime(Config.datetime_format),
-                "updated_at": row.updated_at.strftime(Config.datetime_format)
-            })
-        return result
+        """Retrieve one page of User Model data"""
+        serialize, options = sparse_fields(user_api, user_to_dict, default_keys(User))
+        users, next_cursor = paginate(user_api, User.query.options(*options), default_keys(User),
+                                      versions=User.query.with_entities(User.updated_at))
+        result = [serialize(row) for row in users]
+        return {"results": result, "next_cursor": next_cursor}
 
     @user_api.doc('create a new user')
     @user_api.expect(user_model)
@@ -55,23 +62,25 @@ class Users(Resource):
         data = request.get_json()
         if not data.get('email') or not validate_email(data['email']):
             user_api.abort(400, message='Invalid input')
-        if not data.get('first_name') or not data.get('last_name'):
+        if not data.get('first_name') or not data.get('last_name') or not data.get('password'):
             user_api.abort(400, message='Invalid input')
 
-        password = bcrypt.generate_password_hash(data['password'])
-        existing_user = User.query.filter_by(email=data['email']).first()
+        """Only hash once the cheap checks have passed, duplicates never pay for bcrypt.
+        The probe is a unique-index lookup; the index itself settles concurrent sign-ups."""
+        existing_user = include_deleted(User.query.filter_by(email_normalized=normalize_email(data['email']))).first()
+        if existing_user and existing_user.is_deleted == 0:
+            user_api.abort(409, 'Email already exists')
+        password = hash_or_abort(data['password'])
         if existing_user:
-            if existing_user.is_deleted == 0:
-                user_api.abort(409, 'Email already exists')
-            else:
-                existing_user.first_name = data['first_name']
-                existing_user.last_name = data['last_name']
-                existing_user.password = password
-                existing_user.is_deleted = 0
-                existing_user.updated_at = datetime.now()
-                db.session.commit()
-                return 'User reactivated successfully', 201
-            """End parameter validity check"""
+            existing_user.first_name = data['first_name']
+            existing_user.last_name = data['last_name']
+            existing_user.password = password
+            existing_user.email = data['email']
+            existing_user.is_deleted = 0
+            existing_user.updated_at = datetime.now()
+            db.session.commit()
+            return 'User reactivated successfully', 201
+        """End parameter validity check"""
 
         """Begin data insertion"""
         try:
@@ -84,38 +93,88 @@ class Users(Resource):
             call adds the change to the database session (a temporary area)."""
             db.session.commit()
             return 'User created successfully', 201
+        except IntegrityError:
+            """Another request signed up with this email since the probe"""
+            db.session.rollback()
+            user_api.abort(409, 'Email already exists')
         except Exception as e:
             """If the database commit submission fails, it must be rolled back."""
             db.session.rollback()
             user_api.abort(404, message='Create fail')
         """End data insertion"""
 
+
+@user_api.route('/bulk')
+class UsersBulk(Resource):
+    @user_api.doc('create users in bulk')
+    @user_api.expect([user_model])
+    @user_api.response(201, 'All users created')
+    @user_api.response(207, 'Some users could not be created, see results')
+    @user_api.response(400, 'Invalid input')
+    def post(self):
+        """Create many users: one email lookup, batched inserts, one result per item"""
+        items = bulk_items(user_api)
+        result = BulkResult(len(items))
+
+        valid = []
+        emails = set()
+        for index, data in enumerate(items):
+            if not isinstance(data, dict) or not validate_email(data.get('email')) \
+                    or not data.get('first_name') or not data.get('last_name') or not data.get('password'):
+                result.fail(index, 400, 'Invalid input')
+            elif normalize_email(data['email']) in emails:
+                result.fail(index, 409, 'Email repeated in this request')
+            else:
+                emails.add(normalize_email(data['email']))
+                valid.append((index, data))
+
+        # A deleted account keeps its email; a single sign-up reactivates it instead
+        taken = existing_values(User.email_normalized, emails, include_deleted=True)
+        new_users = []
+        for index, data in valid:
+            if normalize_email(data['email']) in taken:
+                result.fail(index, 409, 'Email already exists')
+            elif not isinstance(data['password'], str):
+                result.fail(index, 400, 'Invalid input')
+            else:
+                new_users.append((index, data))
+
+        try:
+            passwords = hash_passwords([data['password'] for _, data in new_users])
+        except HashingBusy:
+            user_api.abort(503, message='Server busy, please retry')
+        pending = [(index, User(first_name=data['first_name'], last_name=data['last_name'],
+                                email=data['email'], password=password))
+                   for (index, data), password in zip(new_users, passwords)]
+
+        insert_chunks(User, pending, result)
+        return result.response()
+
+
 @user_api.route('/<string:user_id>')
 @user_api.param('user_id', 'The user identifier')
 class UserParam(Resource):
-    @user_api.doc('create user by id')
+    @user_api.doc('create user by id', params={'fields': 'Comma-separated keys to return'})
     @user_api.response(404, 'User not found')
     def get(self, user_id):
-        user = User.query.filter_by(id=user_id, is_deleted=0).first()
+        version = db.session.query(User.updated_at).filter_by(id=user_id).first()
+        if version is None:
+            user_api.abort(404, message='User not found!')
+        check_row(version)
+
+        serialize, options = sparse_fields(user_api, user_to_dict)
+        user = User.query.options(*options).filter_by(id=user_id).first()
 
         if user is None:
             user_api.abort(404, message='User not found!')
         else:
-            return {
-                "id": user.id,
-                "first_name": user.first_name,
-                "last_name": user.last_name,
-                "email": user.email,
-                "password": user.password,
-                "created_at": user.created_at.strftime(Config.datetime_format),
-                "updated_at": user.updated_at.strftime(Config.datetime_format)
-            }
+            return serialize(user)
 
     @user_api.doc('delete_user')
     @user_api.response(204, 'User deleted successfully')
     @user_api.response(404, 'User not found')
     def delete(self, user_id):
-        user = User.query.filter_by(id=user_id, is_deleted=0).first()
+        user = User.query.filter_by(id=user_id).first()
         if user is None:
             return user_api.abort(404, 'User not found')
         try:
@@ -135,26 +194,58 @@ class UserParam(Resource):
     @user_api.response(409, 'Email already exists')
     def put(self, user_id):
         data = request.get_json()
-        if not data:
+        if not data or not validate_email(data.get('email')):
             user_api.abort(400, "Invalid input")
 
-        existing_user = User.query.filter_by(email=data['email'], is_deleted=0).first()
-        if existing_user and existing_user.id != user_id:
+        user = User.query.filter_by(id=user_id).first()
+        if not user:
+            user_api.abort(404, 'User not found')
+        existing_user = include_deleted(User.query.filter_by(email_normalized=normalize_email(data['email']))).first()
+        if existing_user and existing_user.id != user.id:
             user_api.abort(409, 'Email already exists')
+        password = hash_or_abort(data.get('password'))
 
         try:
-            user = User.query.filter_by(id=user_id, is_deleted=0).first()
-            if not user:
-                user_api.abort(404, 'User not found')
-
-            user = User.query.filter_by(id=user_id).first()
             user.first_name = data['first_name']
             user.last_name = data['last_name']
             user.email = data['email']
-            user.password = data['password']
+            user.password = password
             user.updated_at = datetime.now()
             db.session.commit()
             return "update successfully", 200
+        except IntegrityError:
+            db.session.rollback()
+            user_api.abort(409, 'Email already exists')
         except Exception as e:
             db.session.rollback()
-            user_api.abort(404, message='Update fail')
\ No newline at end of file
+            user_api.abort(404, message='Update fail')
+
+
+login_model = user_api.model('Login', {
+    'email': fields.String(required=True, description='Email address'),
+    'password': fields.String(required=True, description='Password')
+})
+
+
+@user_api.route('/login')
+class UserLogin(Resource):
+    @user_api.doc('check a user\'s credentials')
+    @user_api.expect(login_model)
+    @user_api.response(200, 'Credentials are valid')
+    @user_api.response(401, 'Invalid email or password')
+    def post(self):
+        """Verify credentials; hashes made with an older cost factor are upgraded on the way"""
+        data = request.get_json()
+        if not data or not isinstance(data.get('email'), str) or not isinstance(data.get('password'), str):
+            user_api.abort(400, message='Invalid input')
+
+        user = User.query.filter_by(email_normalized=normalize_email(data['email'])).first()
+        try:
+            if user is None or not check_password(user.password, data['password']):
+                user_api.abort(401, message='Invalid email or password')
+            if needs_rehash(user.password):
+                user.password = hash_password(data['password'])
+                db.session.commit()
+        except HashingBusy:
+            user_api.abort(503, message='Server busy, please retry')
+        return user_to_dict(user), 200
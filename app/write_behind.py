@@ -0,0 +1,149 @@
+"""Write-behind queue: validated rows are inserted by a background worker in group commits.
+
+With REVIEW_WRITE_BEHIND=1 the review create endpoints validate a review,
+put it on a bounded in-process queue and answer 202 with its id without
+waiting for a commit. A worker thread takes whatever is queued (up to
+``batch_size`` rows, waiting at most ``batch_delay`` seconds for more)
+and writes it with ``bulk.insert_chunks``, so a burst of N reviews costs
+N / batch_size commits instead of N.
+
+* Backpressure: when the queue is full a request waits up to
+  ``put_timeout`` seconds for room, then gets ``QueueFull`` (answer 503).
+* Shutdown: an ``atexit`` hook stops the worker after it has written
+  everything still queued (bounded by ``flush_timeout``).
+* A queued row is not visible to readers until its batch commits, and a
+  row that fails to insert (e.g. its place was deleted in the meantime)
+  is logged and dropped, since the client has already had its 202.
+
+The queue lives in each worker process.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+
+from app import app
+from app.bulk import BulkResult, insert_chunks
+
+_STOP = object()
+
+
+class QueueFull(Exception):
+    """The queue stayed full for ``put_timeout`` seconds"""
+
+
+class WriteBehindQueue(object):
+    def __init__(self, model, maxsize, batch_size, batch_delay, put_timeout, flush_timeout, after_chunk=None):
+        self.model = model
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.put_timeout = put_timeout
+        self.flush_timeout = flush_timeout
+        self.after_chunk = after_chunk
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self._queue = queue.Queue(maxsize)
+        self._worker = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, obj):
+        """Queue a transient model object for insertion, raising QueueFull when there is no room"""
+        self._start()
+        try:
+            self._queue.put(obj, timeout=self.put_timeout)
+        except queue.Full:
+            raise QueueFull()
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _start(self):
+        if self._worker is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name='write-behind-%s' % self.model.__tablename__,
+                                                daemon=True)
+                self._worker.start()
+                atexit.register(self.flush)
+
+    def _next_batch(self):
+        """Block for the first row, then take more until the batch is full or ``batch_delay`` has passed"""
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.batch_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                obj = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if obj is _STOP:
+                return batch, True
+            batch.append(obj)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if stopping:
+                # Flush: write what is left behind the stop marker too
+                while True:
+                    try:
+                        obj = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if obj is not _STOP:
+                        batch.append(obj)
+            for start in range(0, len(batch), self.batch_size):
+                self._write(batch[start:start + self.batch_size])
+
+    def _write(self, batch):
+        if not batch:
+            return
+        result = BulkResult(len(batch))
+        try:
+            with app.app_context():
+                insert_chunks(self.model, list(enumerate(batch)), result, after_chunk=self.after_chunk)
+        except Exception:
+            app.logger.exception('write-behind batch of %d %s failed', len(batch), self.model.__tablename__)
+            self.failed += len(batch)
+            return
+        dropped = [batch[index].id for index in range(len(batch)) if result.failed(index)]
+        if dropped:
+            app.logger.error('write-behind dropped %d %s: %s', len(dropped), self.model.__tablename__,
+                             ', '.join(dropped))
+        self.batches += 1
+        self.written += len(batch) - len(dropped)
+        self.failed += len(dropped)
+
+    def flush(self):
+        """Write everything queued and stop the worker (runs at exit)"""
+        worker = self._worker
+        if worker is None or self._pid != os.getpid() or not worker.is_alive():
+            return
+        try:
+            # The worker is draining the queue, so room for the stop marker turns up unless it is stuck
+            self._queue.put(_STOP, timeout=self.flush_timeout)
+        except queue.Full:
+            pass
+        worker.join(self.flush_timeout)
+        if worker.is_alive():
+            app.logger.error('write-behind flush timed out with %d %s still queued', self.depth(),
+                             self.model.__tablename__)
+        self._worker = None
+
+    def stats(self):
+        return {
+            "queued": self.depth(),
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
@@ -0,0 +1,63 @@
+"""ASGI entry point: ``uvicorn asgi:application --workers N``.
+
+GET requests for the place, review and city read endpoints are answered on
+the event loop by ``app.async_api`` with an async engine, so thousands of
+slow reads can be waiting on the database at once without a thread each.
+Everything else (writes, users, countries, amenities, search, nearby,
+NDJSON streams, Swagger, /metrics) is passed to the Flask app, which runs
+in a worker thread per request.
+
+Requires the packages in requirements-async.txt.
+"""
+import asyncio
+
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.exceptions import HTTPException
+
+from app import app
+from app.async_api import Request, endpoints, engine, replica_engines, serve
+from app.reference import reference_index
+
+wsgi = WsgiToAsgi(app)
+urls = app.url_map.bind('localhost')
+handlers = endpoints(app)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Build the country/city snapshot before the first request rather than on the event loop
+            await asyncio.to_thread(reference_index.current)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await engine.dispose()
+            for replica in replica_engines.values():
+                await replica.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        try:
+            endpoint, view_args = urls.match(scope['path'], 'GET')
+        except HTTPException:
+            # 404, 405 and the trailing-slash redirect are left to Flask
+            endpoint, view_args = None, None
+        handler = handlers.get(endpoint)
+        if handler is not None:
+            request = Request(scope)
+            if not request.wants_stream():
+                status, headers, body = await serve(endpoint, handler, request, view_args)
+                await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+                await send({'type': 'http.response.body', 'body': body})
+                return
+
+    # WsgiToAsgi runs every request on one shared thread unless each gets its own context
+    async with ThreadSensitiveContext():
+        await wsgi(scope, receive, send)
@@ -0,0 +1,107 @@
+"""Amenity filtering: ``amenity_mask`` bit test vs one place_amenities EXISTS per amenity.
+
+Seeds a throwaway SQLite database with places that each have a random set
+of amenities, then times one page of "places with all of these amenities"
+and "any of these amenities" both ways::
+
+    python benchmarks/amenity_filter_bench.py [--places 50000] [--amenities 12] [--filter 3]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'amenity_bench.db')
+
+from sqlalchemy import and_, exists, insert, or_
+
+from app import app, db
+from app.amenity_filter import amenity_criterion
+from app.ids import uuid7
+from models.amenity import Amenity
+from models.city import City
+from models.country import Country
+from models.place import Place, place_amenities
+from models.user import User
+
+
+def seed(args):
+    rng = random.Random(1)
+    country = Country('Bench', 'BN')
+    db.session.add(country)
+    db.session.flush()
+    city = City('Bench', country.id)
+    user = User('Bench', 'Host', 'host@example.com', 'x')
+    amenities = [Amenity('amenity %d' % i) for i in range(args.amenities)]
+    for bit, amenity in enumerate(amenities):
+        amenity.bit = bit
+    db.session.add_all([city, user] + amenities)
+    db.session.commit()
+
+    started = datetime.now()
+    places, links = [], []
+    for i in range(args.places):
+        place_id = uuid7()
+        chosen = [a for a in amenities if rng.random() < 0.3]
+        mask = 0
+        for amenity in chosen:
+            mask |= 1 << amenity.bit
+            links.append({'place_id': place_id, 'amenity_id': amenity.id, 'created_at': started})
+        places.append({'id': place_id, 'host_id': user.id, 'city_id': city.id, 'name': 'p%d' % i,
+                       'number_of_rooms': 1, 'number_of_bathrooms': 1, 'price_per_night': 10, 'max_guests': 2,
+                       'created_at': started + timedelta(seconds=i), 'updated_at': started,
+                       'amenity_mask': mask})
+    db.session.execute(insert(Place), places)
+    db.session.execute(insert(place_amenities), links)
+    db.session.commit()
+    return amenities
+
+
+def joined(ids, match):
+    """The criterion a join-based filter would use: one EXISTS per amenity"""
+    clauses = [exists().where(place_amenities.c.place_id == Place.id, place_amenities.c.amenity_id == amenity_id)
+               for amenity_id in ids]
+    return and_(*clauses) if match == 'all' else or_(*clauses)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--places', type=int, default=50000)
+    parser.add_argument('--amenities', type=int, default=12)
+    parser.add_argument('--filter', type=int, default=3, help='number of amenities in the filter')
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        amenities = seed(args)
+        chosen = amenities[:args.filter]
+        ids = [amenity.id for amenity in chosen]
+        bits = {amenity.id: amenity.bit for amenity in chosen}
+        print('%d places, filter on %d of %d amenities, page of %d'
+              % (args.places, args.filter, args.amenities, args.limit))
+
+        for match in ('all', 'any'):
+            def page(criterion):
+                return db.session.query(Place.id).filter(criterion) \
+                    .order_by(Place.created_at, Place.id).limit(args.limit).all()
+
+            def count(criterion):
+                return db.session.query(Place.id).filter(criterion).count()
+
+            masked, exists_each = amenity_criterion(ids, match, bits), joined(ids, match)
+            assert page(masked) == page(exists_each) and count(masked) == count(exists_each)
+            for label, criterion in (('bitmask', masked), ('exists per amenity', exists_each)):
+                best_page = min(timeit.repeat(lambda: page(criterion), number=1, repeat=5))
+                best_count = min(timeit.repeat(lambda: count(criterion), number=1, repeat=3))
+                print('%-4s %-20s page %8.2f ms   count %8.2f ms (%d places)'
+                      % (match, label, best_page * 1000, best_count * 1000, count(criterion)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""Concurrency benchmark: the threaded WSGI server against the ASGI server.
+
+Seeds a database (``loadtest.seed``), starts each server in turn on the
+same data and holds an increasing number of keep-alive connections open
+against the read endpoints that ``asgi.py`` serves asynchronously,
+reporting throughput, latency and errors (5xx, refused or timed-out
+connections) at each level::
+
+    pip install -r requirements-async.txt
+    python benchmarks/concurrency_bench.py [--levels 10,50,200,500] [--duration 10] [--out results.json]
+
+The servers are ``app.run(threaded=True)`` (what ``app.py`` runs) and
+``uvicorn asgi:application`` with one worker process. Without
+DATABASE_URL/DB_PROFILE a throwaway SQLite database is used; point
+DATABASE_URL at MySQL to see the effect of real query latency.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from loadtest import ROOT, git_revision, load_ids, percentile, seed
+
+SERVERS = {
+    'threaded': [sys.executable, '-c', 'from app import app; app.run(port={port}, threaded=True)'],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', '{port}', '--log-level', 'warning'],
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--servers', default=','.join(SERVERS), help='comma-separated: threaded, asgi')
+    parser.add_argument('--levels', default='10,50,200,500', help='comma-separated numbers of open connections')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per level')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds before a request counts as an error')
+    parser.add_argument('--scale', type=float, default=0.2, help='multiplier for the seeded row counts')
+    parser.add_argument('--no-seed', action='store_true', help='use the rows already in the database')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='write the results as JSON to this file')
+    return parser.parse_args()
+
+
+def request_paths(ids, rng, count=500):
+    """A fixed mix of GETs on the async read endpoints"""
+    templates = [
+        (5, lambda: '/api/v1/place/place/%s' % rng.choice(ids['place'])[0]),
+        (2, lambda: '/api/v1/place?limit=20'),
+        (3, lambda: '/api/v1/place/%s/reviews' % rng.choice(ids['place'])[0]),
+        (2, lambda: '/api/v1/review/%s' % rng.choice(ids['review'])[0]),
+        (1, lambda: '/api/v1/review?limit=20'),
+        (1, lambda: '/api/v1/city/%s' % rng.choice(ids['city'])[0]),
+        (1, lambda: '/api/v1/city/?limit=50'),
+        (1, lambda: '/api/v1/city/%s/cities' % rng.choice(ids['country'])[1]),
+    ]
+    weights = [weight for weight, _ in templates]
+    return [rng.choices(templates, weights)[0][1]() for _ in range(count)]
+
+
+def start_server(name, port):
+    command = [part.format(port=port) for part in SERVERS[name]]
+    # The dev server logs every request; a pipe nobody reads would fill up and stall it
+    log = tempfile.TemporaryFile()
+    server = subprocess.Popen(command, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            log.seek(0)
+            raise SystemExit('%s server exited:\n%s' % (name, log.read().decode()))
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise SystemExit('%s server did not start on port %d' % (name, port))
+
+
+async def fetch(reader, writer, path):
+    """One GET on a keep-alive connection; returns ``(status, connection_closed)``"""
+    writer.write(('GET %s HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n' % path).encode())
+    await writer.drain()
+    status_line = await reader.readline()
+    version, status = status_line.split()[:2]
+    close = version == b'HTTP/1.0'
+    length = None
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'connection':
+            close = value.strip().lower() == 'close'
+    if length is None:
+        await reader.read()
+        close = True
+    else:
+        await reader.readexactly(length)
+    return int(status), close
+
+
+async def client(port, paths, deadline, timeout, samples, rng):
+    connection = None
+    while time.perf_counter() < deadline:
+        path = rng.choice(paths)
+        started = time.perf_counter()
+        try:
+            if connection is None:
+                connection = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+            status, close = await asyncio.wait_for(fetch(connection[0], connection[1], path), timeout)
+        except (OSError, ValueError, IndexError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            status, close = 0, True
+        samples.append((status, time.perf_counter() - started))
+        if close and connection is not None:
+            connection[1].close()
+            connection = None
+    if connection is not None:
+        connection[1].close()
+
+
+async def run_level(port, paths, connections, duration, timeout, seed_value):
+    samples = []
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*[client(port, paths, deadline, timeout, samples, random.Random(seed_value + i))
+                           for i in range(connections)])
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for status, latency in samples if 0 < status < 500)
+    errors = sum(1 for status, _ in samples if status == 0 or status >= 500)
+    return {
+        'connections': connections,
+        'requests': len(samples),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+def report(results):
+    header = '%-9s %11s %9s %7s %9s %9s %9s' % ('server', 'connections', 'requests', 'errors', 'req/s', 'p50 ms',
+                                             'p99 ms')
+    print(header)
+    print('-' * len(header))
+    for name, levels in results.items():
+        for level in levels:
+            print('%-9s %11d %9d %7d %9.1f %9.2f %9.2f' % (
+                name, level['connections'], level['requests'], level['errors'], level['throughput_rps'],
+                level['p50_ms'], level['p99_ms']))
+
+
+def main():
+    args = parse_args()
+    if not os.environ.get('DATABASE_URL') and not os.environ.get('DB_PROFILE'):
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'concurrency.db')
+
+    from app import app, db
+
+    rng = random.Random(args.seed)
+    with app.app_context():
+        db.create_all()
+        if not args.no_seed:
+            seed(args.scale, rng)
+        paths = request_paths(load_ids(), rng)
+        database = db.engine.url.render_as_string(hide_password=True)
+
+    levels = [int(level) for level in args.levels.split(',')]
+    results = {}
+    for name in args.servers.split(','):
+        server = start_server(name, args.port)
+        try:
+            # Warm up caches and connection pools before measuring
+            asyncio.run(run_level(args.port, paths, 4, 1, args.timeout, args.seed))
+            results[name] = [asyncio.run(run_level(args.port, paths, connections, args.duration, args.timeout,
+                                                   args.seed)) for connections in levels]
+        finally:
+            server.terminate()
+            server.wait()
+
+    report(results)
+    if args.out:
+        with open(args.out, 'w') as out:
+            json.dump({'revision': git_revision(), 'database': database, 'duration_s': args.duration,
+                       'results': results}, out, indent=2)
+        print('wrote', args.out)
+
+
+if __name__ == '__main__':
+    main()
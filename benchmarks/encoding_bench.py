@@ -0,0 +1,54 @@
+"""Micro-benchmark: JSON encoders and response compression on a large list body.
+
+Encodes a ``/api/v1/review``-style page of serialized reviews with the
+standard library and with orjson, then compresses it at a few gzip levels
+(and brotli qualities, if the package is installed). No database is needed::
+
+    python benchmarks/encoding_bench.py [rows]
+"""
+import gzip
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, encoding
+from app.serializers import review_detail
+from serializers_bench import build_rows
+
+
+def bench(label, func, repeat=5):
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    result = func()
+    print('%-24s %9.1f ms %10.1f KB' % (label, best * 1000, len(result) / 1024.0))
+    return best, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    with app.app_context():
+        _, reviews = build_rows(count)
+        page = {"results": [review_detail(review) for review in reviews], "next_cursor": None}
+
+    print('%d reviews' % count)
+    print('%-24s %12s %13s' % ('', 'time', 'size'))
+    old, body = bench('json (stdlib)', lambda: encoding.stdlib_dumps(page))
+    if encoding.orjson is not None:
+        new, fast = bench('orjson', lambda: encoding.orjson_dumps(page))
+        assert encoding.orjson.loads(fast) == encoding.orjson.loads(body)
+        print('%-24s %9.2fx' % ('encode speed-up', old / new))
+    else:
+        print('orjson is not installed')
+
+    for level in (1, 6, 9):
+        bench('gzip level %d' % level, lambda: gzip.compress(body, compresslevel=level, mtime=0))
+    if encoding.brotli is not None:
+        for quality in (1, 4, 11):
+            bench('brotli quality %d' % quality, lambda: encoding.brotli.compress(body, quality=quality))
+    else:
+        print('brotli is not installed')
+
+
+if __name__ == '__main__':
+    main()
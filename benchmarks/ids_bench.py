@@ -0,0 +1,119 @@
+"""Insert and lookup cost of string UUIDv4 keys vs 16-byte UUIDv7 keys.
+
+Builds two copies of a parent/child table pair (like places and reviews),
+one keyed by ``String(60)`` ``uuid4`` strings and one by ``BinaryUUID``
+``uuid7`` values, inserts the same number of rows into each, then times
+primary key lookups and a child -> parent join, and reports the space the
+tables and their indexes take::
+
+    python benchmarks/ids_bench.py [--rows 200000] [--lookups 20000] [--url mysql+pymysql://...]
+
+Without --url each variant gets its own throwaway SQLite file.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table, create_engine, \
+    func, insert, select, text
+
+from app.ids import BinaryUUID, uuid7
+
+VARIANTS = [
+    ('string uuid4', lambda: String(60), lambda: str(uuid.uuid4())),
+    ('binary uuid7', BinaryUUID, uuid7),
+]
+
+
+def tables(key_type):
+    metadata = MetaData()
+    parents = Table('bench_parents', metadata,
+                    Column('id', key_type(), primary_key=True),
+                    Column('created_at', DateTime, nullable=False),
+                    Column('value', Integer, nullable=False))
+    children = Table('bench_children', metadata,
+                     Column('id', key_type(), primary_key=True),
+                     Column('parent_id', key_type(), ForeignKey('bench_parents.id'), nullable=False),
+                     Column('created_at', DateTime, nullable=False),
+                     Index('ix_bench_children_parent', 'parent_id', 'created_at', 'id'))
+    return metadata, parents, children
+
+
+def size(engine, metadata):
+    """Bytes taken by the tables and their indexes"""
+    names = [table.name for table in metadata.sorted_tables]
+    with engine.connect() as connection:
+        if engine.dialect.name == 'mysql':
+            connection.execute(text('ANALYZE TABLE ' + ', '.join(names)))
+            return connection.execute(text(
+                'SELECT SUM(data_length + index_length) FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name IN :names').bindparams(names=tuple(names))).scalar()
+        page_size = connection.execute(text('PRAGMA page_size')).scalar()
+        return connection.execute(text('PRAGMA page_count')).scalar() * page_size
+
+
+def run(label, key_type, new_id, args, url):
+    engine = create_engine(url)
+    metadata, parents, children = tables(key_type)
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+
+    parent_ids = [new_id() for _ in range(args.rows // 4)]
+    child_ids = [new_id() for _ in range(args.rows)]
+    now = datetime.now()
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        for start in range(0, len(parent_ids), args.batch_size):
+            connection.execute(insert(parents), [{'id': id, 'created_at': now, 'value': 1}
+                                                 for id in parent_ids[start:start + args.batch_size]])
+        for start in range(0, len(child_ids), args.batch_size):
+            connection.execute(insert(children), [
+                {'id': id, 'parent_id': parent_ids[(start + i) % len(parent_ids)], 'created_at': now}
+                for i, id in enumerate(child_ids[start:start + args.batch_size])])
+    inserted = time.perf_counter() - started
+
+    sample = random.Random(1).sample(child_ids, min(args.lookups, len(child_ids)))
+    with engine.connect() as connection:
+        started = time.perf_counter()
+        for id in sample:
+            connection.execute(select(children.c.parent_id).where(children.c.id == id)).one()
+        lookups = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for id in sample[:args.lookups // 10]:
+            connection.execute(select(parents.c.value, func.count()).join_from(parents, children)
+                               .where(children.c.id == id).group_by(parents.c.value)).one()
+        joins = time.perf_counter() - started
+
+    total = size(engine, metadata)
+    metadata.drop_all(engine)
+    engine.dispose()
+    print('%-14s insert %8.0f rows/s   lookup %7.1f us   join %7.1f us   size %8.1f MB'
+          % (label, (len(parent_ids) + len(child_ids)) / inserted, lookups / len(sample) * 1e6,
+             joins / max(len(sample) // 10, 1) * 1e6, total / 1024.0 / 1024.0))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--url', help='database to run in (default: a new SQLite file per variant)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    print('%d child rows, %d parent rows' % (args.rows, args.rows // 4))
+    for label, key_type, new_id in VARIANTS:
+        url = args.url or 'sqlite:///' + os.path.join(directory, label.replace(' ', '_') + '.db')
+        run(label, key_type, new_id, args, url)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+"""Load test: replay a weighted request mix against the API and report latency per route.
+
+Seeds a database through the models, then replays a scenario file (one JSON
+request template per line, see ``benchmarks/scenarios/default.jsonl``)
+either in-process through the Flask test client or against a running
+server::
+
+    python benchmarks/loadtest.py [--scale 1] [--requests 5000] [--threads 4] [--out results.json]
+    DATABASE_URL=mysql+pymysql://... python benchmarks/loadtest.py --base-url http://127.0.0.1:5000
+
+Without ``--base-url`` and without DATABASE_URL/DB_PROFILE, a throwaway
+SQLite database is used. With ``--base-url`` the server must be using the
+same database as this script, since request templates are filled in with
+ids read from it. The request sequence is drawn from ``--seed``, so two
+runs against the same data issue the same requests.
+
+Scenario lines look like::
+
+    {"name": "places.get", "method": "GET", "path": "/api/v1/place/place/{place_id}", "weight": 12}
+
+String values in ``path`` and ``json`` may use ``{user_id}``, ``{user_email}``,
+``{country_id}``, ``{country_code}``, ``{city_id}``, ``{place_id}``,
+``{review_id}``, ``{amenity_id}``, ``{lat}``, ``{lon}`` and ``{n}`` (a
+unique counter). Results are printed and written as JSON; pass a previous
+result file as ``--compare`` to see the change per route.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_SCENARIO = os.path.join(ROOT, 'benchmarks', 'scenarios', 'default.jsonl')
+PASSWORD = 'loadtest-password'
+
+# Rows per unit of --scale
+SIZES = {'countries': 20, 'cities': 200, 'users': 1000, 'amenities': 50, 'places': 5000, 'reviews': 20000}
+
+# Seeded places are scattered around a few city centres so /nearby finds neighbours
+CENTRES = [(48.8566, 2.3522), (40.7128, -74.0060), (35.6762, 139.6503), (-33.8688, 151.2093),
+           (51.5072, -0.1276), (52.5200, 13.4050)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scenario', default=DEFAULT_SCENARIO)
+    parser.add_argument('--base-url', help='run against a server instead of the in-process test client')
+    parser.add_argument('--scale', type=float, default=1, help='multiplier for the seeded row counts')
+    parser.add_argument('--no-seed', action='store_true', help='use the rows already in the database')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=200, help='requests sent before timing starts')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='a previous --out file to compare against')
+    return parser.parse_args()
+
+
+def load_scenario(path):
+    templates = []
+    with open(path) as scenario:
+        for number, line in enumerate(scenario, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            template = json.loads(line)
+            if 'path' not in template:
+                raise SystemExit('{}:{}: a request needs a "path"'.format(path, number))
+            template.setdefault('method', 'GET')
+            template.setdefault('name', '{} {}'.format(template['method'], template['path'].split('?')[0]))
+            template.setdefault('weight', 1)
+            templates.append(template)
+    if not templates:
+        raise SystemExit('{}: no requests'.format(path))
+    return templates
+
+
+def seed(scale, rng):
+    """Insert a synthetic data set through the models, committing table by table"""
+    from app import db, hashing
+    from models.amenity import Amenity
+    from models.city import City
+    from models.country import Country
+    from models.place import Place
+    from models.review import Review
+    from models.user import User
+
+    sizes = {table: max(1, int(count * scale)) for table, count in SIZES.items()}
+    # One real hash shared by every seeded user, so login works without paying for thousands of hashes
+    password = hashing.hash_password(PASSWORD)
+    stamp = '%x' % int(time.time())
+
+    countries = [Country(name='Country %d' % i, code='%s%s' % (chr(65 + i // 26 % 26), chr(65 + i % 26)))
+                 for i in range(sizes['countries'])]
+    db.session.add_all(countries)
+    db.session.commit()
+
+    cities = [City(name='City %d' % i, country_id=countries[i % len(countries)].id) for i in range(sizes['cities'])]
+    db.session.add_all(cities)
+    db.session.commit()
+
+    users = [User(first_name='Load', last_name='User %d' % i, email='seed-%s-%d@example.com' % (stamp, i),
+                  password=password) for i in range(sizes['users'])]
+    db.session.add_all(users)
+    db.session.commit()
+
+    db.session.add_all([Amenity(name='Amenity %d' % i) for i in range(sizes['amenities'])])
+    db.session.commit()
+
+    places = []
+    for i in range(sizes['places']):
+        lat, lon = CENTRES[i % len(CENTRES)]
+        places.append(Place(host_id=rng.choice(users).id, city_id=rng.choice(cities).id, name='Place %d' % i,
+                            number_of_rooms=rng.randint(1, 5), number_of_bathrooms=rng.randint(1, 3),
+                            price_per_night=rng.randint(20, 500), max_guests=rng.randint(1, 10),
+                            latitude=lat + rng.uniform(-0.2, 0.2), longitude=lon + rng.uniform(-0.2, 0.2)))
+    db.session.add_all(places)
+    db.session.commit()
+
+    reviews = []
+    for i in range(sizes['reviews']):
+        place = rng.choice(places)
+        review = Review(user_id=rng.choice(users).id, place_id=place.id, comment='Review %d' % i,
+                        rating=rng.randint(1, 5))
+        place.review_count += 1
+        place.rating_sum += review.rating
+        reviews.append(review)
+        if len(reviews) == 5000:
+            db.session.add_all(reviews)
+            db.session.commit()
+            reviews = []
+    db.session.add_all(reviews)
+    db.session.commit()
+    return sizes
+
+
+def load_ids(limit=1000):
+    """Ids (and a few other values) the request templates are filled in with"""
+    from app import db
+    from models.amenity import Amenity
+    from models.city import City
+    from models.country import Country
+    from models.place import Place
+    from models.review import Review
+    from models.user import User
+
+    def column(*columns, **filters):
+        return db.session.query(*columns).filter_by(**filters).limit(limit).all()
+
+    ids = {
+        'user': column(User.id, User.email, is_deleted=0),
+        'country': column(Country.id, Country.code),
+        'city': column(City.id, is_deleted=0),
+        'place': column(Place.id, Place.latitude, Place.longitude, is_deleted=0),
+        'review': column(Review.id, is_deleted=0),
+        'amenity': column(Amenity.id, is_deleted=0),
+    }
+    empty = [name for name, rows in ids.items() if not rows]
+    if empty:
+        raise SystemExit('No {} rows to test against; run without --no-seed'.format(', '.join(empty)))
+    return ids
+
+
+def fill(value, values):
+    if isinstance(value, str):
+        return value.format(**values)
+    if isinstance(value, dict):
+        return {key: fill(item, values) for key, item in value.items()}
+    if isinstance(value, list):
+        return [fill(item, values) for item in value]
+    return value
+
+
+def plan(templates, ids, count, rng, counter):
+    """Draw ``count`` concrete requests from the weighted templates"""
+    weights = [template['weight'] for template in templates]
+    requests = []
+    for template in rng.choices(templates, weights=weights, k=count):
+        user, place = rng.choice(ids['user']), rng.choice(ids['place'])
+        country = rng.choice(ids['country'])
+        values = {
+            'user_id': user.id, 'user_email': user.email,
+            'country_id': country.id, 'country_code': country.code,
+            'city_id': rng.choice(ids['city']).id,
+            'place_id': place.id, 'lat': place.latitude or 0, 'lon': place.longitude or 0,
+            'review_id': rng.choice(ids['review']).id,
+            'amenity_id': rng.choice(ids['amenity']).id,
+            'n': next(counter),
+        }
+        requests.append((template['name'], template['method'], fill(template['path'], values),
+                         fill(template.get('json'), values)))
+    return requests
+
+
+class TestClientTransport(object):
+    def __init__(self):
+        from app import app
+        self.client = app.test_client()
+
+    def send(self, method, path, body):
+        response = self.client.open(path, method=method, json=body)
+        response.get_data()
+        return response.status_code
+
+
+class HTTPTransport(object):
+    """One keep-alive connection per client thread"""
+
+    def __init__(self, base_url):
+        url = urlsplit(base_url)
+        self.prefix = url.path.rstrip('/')
+        connection = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection(url.hostname, url.port, timeout=60)
+
+    def send(self, method, path, body):
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.connection.request(method, self.prefix + path, body=data, headers=headers)
+            response = self.connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            self.connection.request(method, self.prefix + path, body=data, headers=headers)
+            response = self.connection.getresponse()
+        response.read()
+        return response.status
+
+
+def replay(requests, threads, make_transport):
+    """Send ``requests`` from ``threads`` client threads; return samples and wall time"""
+    samples = [[] for _ in range(threads)]
+
+    def worker(index):
+        transport = make_transport()
+        out = samples[index]
+        for name, method, path, body in requests[index::threads]:
+            started = time.perf_counter()
+            try:
+                status = transport.send(method, path, body)
+            except Exception:
+                status = 0
+            out.append((name, status, time.perf_counter() - started))
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return [sample for chunk in samples for sample in chunk], time.perf_counter() - started
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def summarize(samples, elapsed):
+    def stats(rows):
+        latencies = sorted(latency for _, _, latency in rows)
+        statuses = {}
+        for _, status, _ in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return {
+            'requests': len(rows),
+            'errors': sum(1 for _, status, _ in rows if status == 0 or status >= 500),
+            'statuses': statuses,
+            'throughput_rps': round(len(rows) / elapsed, 2),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3),
+        }
+
+    routes = {}
+    for sample in samples:
+        routes.setdefault(sample[0], []).append(sample)
+    return stats(samples), {name: stats(rows) for name, rows in sorted(routes.items())}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(result, baseline=None):
+    header = '%-24s %8s %7s %9s %9s %9s %9s' % ('route', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms')
+    print(header)
+    print('-' * len(header))
+    rows = sorted(result['routes'].items()) + [('TOTAL', result['total'])]
+    for name, stats in rows:
+        line = '%-24s %8d %7d %9.1f %9.2f %9.2f %9.2f' % (
+            name, stats['requests'], stats['errors'], stats['throughput_rps'], stats['p50_ms'], stats['p95_ms'],
+            stats['p99_ms'])
+        before = baseline and (baseline['total'] if name == 'TOTAL' else baseline['routes'].get(name))
+        if before and before['p95_ms']:
+            line += '   p95 %+6.1f%%' % ((stats['p95_ms'] / before['p95_ms'] - 1) * 100)
+        print(line)
+
+
+def main():
+    args = parse_args()
+    if not args.base_url and not os.environ.get('DATABASE_URL') and not os.environ.get('DB_PROFILE'):
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'loadtest.db')
+
+    from app import app, db
+
+    templates = load_scenario(args.scenario)
+    rng = random.Random(args.seed)
+    sizes = None
+    with app.app_context():
+        db.create_all()
+        if not args.no_seed:
+            started = time.perf_counter()
+            sizes = seed(args.scale, rng)
+            print('seeded %s in %.1fs' % (', '.join('%d %s' % (sizes[t], t) for t in SIZES),
+                                          time.perf_counter() - started))
+        ids = load_ids()
+        database = db.engine.url.render_as_string(hide_password=True)
+
+    counter = iter(range(sys.maxsize))
+    warmup = plan(templates, ids, args.warmup, rng, counter)
+    requests = plan(templates, ids, args.requests, rng, counter)
+
+    if args.base_url:
+        make_transport = lambda: HTTPTransport(args.base_url)
+    else:
+        make_transport = TestClientTransport
+
+    replay(warmup, args.threads, make_transport)
+    samples, elapsed = replay(requests, args.threads, make_transport)
+    total, routes = summarize(samples, elapsed)
+
+    result = {
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'target': args.base_url or 'test client',
+        'database': database,
+        'scenario': os.path.relpath(args.scenario, ROOT),
+        'seeded': sizes,
+        'requests': args.requests,
+        'threads': args.threads,
+        'seed': args.seed,
+        'elapsed_s': round(elapsed, 3),
+        'total': total,
+        'routes': routes,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as previous:
+            baseline = json.load(previous)
+    report(result, baseline)
+    if args.out:
+        with open(args.out, 'w') as out:
+            json.dump(result, out, indent=2)
+        print('wrote', args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Micro-benchmark: compiled serializers vs the hand-written dict builders.
+
+Runs on transient model objects, so no database is needed::
+
+    python benchmarks/serializers_bench.py [rows]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from app.serializers import place_detail, review_detail
+from config import Config
+from models.city import City
+from models.place import Place
+from models.review import Review
+from models.user import User
+
+
+def legacy_place(place):
+    """The dict builder PlaceList.get used before app.serializers"""
+    return {
+        "id": place.id,
+        "host_id": place.host_id,
+        "city_id": place.city_id,
+        "name": place.name,
+        "description": place.description,
+        "address": place.address,
+        "latitude": place.latitude,
+        "longitude": place.longitude,
+        "number_of_rooms": place.number_of_rooms,
+        "number_of_bathrooms": place.number_of_bathrooms,
+        "price_per_night": place.price_per_night,
+        "max_guests": place.max_guests,
+        "created_at": place.created_at.strftime(Config.datetime_format),
+        "updated_at": place.updated_at.strftime(Config.datetime_format),
+        "user": {
+            "id": place.host.id,
+            "first_name": place.host.first_name,
+            "last_name": place.host.last_name,
+            "email": place.host.email,
+            "created_at": place.host.created_at.strftime(Config.datetime_format),
+            "updated_at": place.host.updated_at.strftime(Config.datetime_format),
+        },
+        "city": {
+            "id": place.city.id,
+            "name": place.city.name,
+            "country_id": place.city.country_id,
+            "created_at": place.city.created_at.strftime(Config.datetime_format),
+            "updated_at": place.city.updated_at.strftime(Config.datetime_format),
+        }
+    }
+
+
+def legacy_review(review):
+    """The dict builder ReviewList.get used before app.serializers"""
+    return {
+        "id": review.id,
+        "user_id": review.user_id,
+        "user": {
+            "id": review.user.id,
+            "first_name": review.user.first_name,
+            "last_name": review.user.last_name,
+            "email": review.user.email
+        },
+        "place_id": review.place_id,
+        "place": {
+            "id": review.place.id,
+            "name": review.place.name,
+            "city_id": review.place.city_id,
+            "address": review.place.address,
+            "price_per_night": review.place.price_per_night
+        },
+        "comment": review.comment,
+        "rating": review.rating,
+        "created_at": review.created_at.strftime(Config.datetime_format),
+        "updated_at": review.updated_at.strftime(Config.datetime_format)
+    }
+
+
+def build_rows(count):
+    host = User('Ada', 'Lovelace', 'ada@example.com', 'hash')
+    city = City('Paris', 'country-id')
+    places, reviews = [], []
+    for i in range(count):
+        place = Place(host.id, city.id, 'Place %d' % i, 2, 1, 100 + i, 4, address='1 rue de Rivoli',
+                      latitude=48.86, longitude=2.35)
+        place.host = host
+        place.city = city
+        review = Review(host.id, place.id, 'Lovely', 4.5)
+        review.user = host
+        review.place = place
+        places.append(place)
+        reviews.append(review)
+    return places, reviews
+
+
+def bench(label, func, rows, repeat=5):
+    assert [func(row) for row in rows[:1]]
+    best = min(timeit.repeat(lambda: [func(row) for row in rows], number=1, repeat=repeat))
+    print('%-28s %8.1f ms  %6.2f us/row' % (label, best * 1000, best / len(rows) * 1e6))
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    with app.app_context():
+        places, reviews = build_rows(count)
+        assert legacy_place(places[0]).items() <= place_detail(places[0]).items()
+        assert legacy_review(reviews[0]).items() <= review_detail(reviews[0]).items()
+        print('%d rows' % count)
+        old = bench('place (hand-written)', legacy_place, places)
+        new = bench('place (compiled)', place_detail, places)
+        print('%-28s %8.2fx' % ('speed-up', old / new))
+        old = bench('review (hand-written)', legacy_review, reviews)
+        new = bench('review (compiled)', review_detail, reviews)
+        print('%-28s %8.2fx' % ('speed-up', old / new))
+
+
+if __name__ == '__main__':
+    main()
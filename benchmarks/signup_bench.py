@@ -0,0 +1,86 @@
+"""Sign-up throughput: bcrypt on the request thread vs the hashing process pool.
+
+Runs POST /api/v1/users/ through the Flask test client from several client
+threads against a throwaway SQLite database::
+
+    python benchmarks/signup_bench.py [--users 64] [--threads 8] [--rounds 12]
+
+For each mode it reports sign-ups per second and per core. It also times a
+duplicate sign-up, which used to pay for a full hash before the email check
+rejected it.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'signup_bench.db')
+
+from config import Config
+from app import app, db, hashing
+
+
+def run(label, pool_size, args, offset):
+    Config.BCRYPT_POOL_SIZE = pool_size
+    hashing.shutdown()
+    if pool_size:
+        hashing.hash_password('warm-up')  # start the worker processes outside the timing
+
+    def worker(thread_index):
+        client = app.test_client()
+        for i in range(thread_index, args.users, args.threads):
+            response = client.post('/api/v1/users/', json={
+                'email': 'user%d-%d@example.com' % (offset, i), 'first_name': 'Bench', 'last_name': 'User',
+                'password': 'correct horse battery staple'})
+            assert response.status_code == 201, response.data
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    cores = min(pool_size or args.threads, os.cpu_count() or 1)
+    rate = args.users / elapsed
+    print('%-34s %7.1f sign-ups/s  %7.1f per core (%d core%s)'
+          % (label, rate, rate / cores, cores, '' if cores == 1 else 's'))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=Config.BCRYPT_LOG_ROUNDS)
+    parser.add_argument('--pool-size', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    Config.BCRYPT_LOG_ROUNDS = args.rounds
+
+    with app.app_context():
+        db.create_all()
+
+    print('bcrypt cost %d, %d sign-ups from %d client threads' % (args.rounds, args.users, args.threads))
+    run('inline (request thread)', 0, args, 0)
+    run('process pool', args.pool_size, args, 1)
+
+    client = app.test_client()
+    payload = {'email': 'user0-0@example.com', 'first_name': 'Bench', 'last_name': 'User', 'password': 'x'}
+    started = time.perf_counter()
+    for _ in range(20):
+        assert client.post('/api/v1/users/', json=payload).status_code == 409
+    duplicate = (time.perf_counter() - started) / 20
+    started = time.perf_counter()
+    hashing.hash_password('x')
+    one_hash = time.perf_counter() - started
+    print('%-34s %7.2f ms  (a hash alone costs %.1f ms)' % ('duplicate sign-up rejected in', duplicate * 1000,
+                                                             one_hash * 1000))
+    hashing.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,40 @@
-import uuid
 from datetime import datetime
+from sqlalchemy import func
 from app import db
+from app.ids import BinaryUUID, uuid7
+from app.soft_delete import SoftDelete, include_deleted
 
-class Amenity(db.Model):
+"""Bits of places.amenity_mask (a signed 64-bit integer) that amenities can be given"""
+MASK_BITS = 63
+
+
+class Amenity(SoftDelete, db.Model):
     __tablename__ = 'amenities'
+    __table_args__ = (
+        db.Index('ix_amenities_created_at_id', 'created_at', 'id'),
+        db.Index('ix_amenities_live_created', 'is_deleted', 'created_at', 'id'),
+        db.Index('ux_amenities_bit', 'bit', unique=True),
+    )
 
-    id = db.Column(db.String(60), primary_key=True)
+    id = db.Column(BinaryUUID, primary_key=True)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
     name = db.Column(db.String(60), nullable=False)
-    is_deleted = db.Column(db.Boolean, default=False, nullable=False)
+    # Position in places.amenity_mask; None once all MASK_BITS are taken (filtered through place_amenities)
+    bit = db.Column(db.SmallInteger, nullable=True)
 
     def __init__(self, name):
-        self.id = str(uuid.uuid4())
+        self.id = uuid7()
         self.name = name
         self.created_at = datetime.now()
-        self.updated_at = datetime.now()
\ No newline at end of file
+        self.updated_at = datetime.now()
+
+    @classmethod
+    def next_bit(cls):
+        """The next unused mask bit, or None if there is none left.
+
+        Bits of deleted amenities are not handed out again, since places may still have them set.
+        """
+        last = include_deleted(db.session.query(func.max(cls.bit))).scalar()
+        bit = 0 if last is None else last + 1
+        return bit if bit < MASK_BITS else None
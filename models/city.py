@@ -1,21 +1,26 @@
-import uuid
 from app import db
+from app.ids import BinaryUUID, uuid7
+from app.soft_delete import SoftDelete
 from datetime import datetime
 
 
-class City(db.Model):
+class City(SoftDelete, db.Model):
     __tablename__ = 'cities'
+    __table_args__ = (
+        db.Index('ix_cities_created_at_id', 'created_at', 'id'),
+        db.Index('ix_cities_live_created', 'is_deleted', 'created_at', 'id'),
+        db.Index('ix_cities_country_live', 'country_id', 'is_deleted'),
+    )
 
-    id = db.Column(db.String(60), primary_key=True)
+    id = db.Column(BinaryUUID, primary_key=True)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
     name = db.Column("name", db.String(60), nullable=False)
-    country_id = db.Column("country_id", db.String(60), db.ForeignKey('countries.id'), nullable=False)
+    country_id = db.Column("country_id", BinaryUUID, db.ForeignKey('countries.id'), nullable=False)
     places = db.relationship('Place', backref='city', lazy='dynamic')
-    is_deleted = db.Column(db.Boolean, default=False, nullable=False)
 
     def __init__(self, name, country_id):
-        self.id = str(uuid.uuid4())
+        self.id = uuid7()
         self.name = name
         self.country_id = country_id
         self.created_at = datetime.now()
@@ -1,14 +1,20 @@
-import uuid
 from datetime import datetime
 """从api的__init__.py中导入变量db"""
 from app import db
+from app.ids import BinaryUUID, uuid7
+from app.soft_delete import SoftDelete
 from models.city import City
 
 
-class Country(db.Model):
+class Country(SoftDelete, db.Model):
     __tablename__ = 'countries'
+    __table_args__ = (
+        db.Index('ix_countries_created_at_id', 'created_at', 'id'),
+        db.Index('ix_countries_live_created', 'is_deleted', 'created_at', 'id'),
+        db.Index('ix_countries_code', 'code'),
+    )
 
-    id = db.Column(db.String(60), nullable=False, primary_key=True)
+    id = db.Column(BinaryUUID, nullable=False, primary_key=True)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.now())
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now())
     name = db.Column("name", db.String(60), nullable=False)
@@ -16,7 +22,7 @@ class Country(db.Model):
     cities = db.relationship(City, backref='country', lazy='dynamic')
 
     def __init__(self, name, code):
-        self.id = str(uuid.uuid4())
+        self.id = uuid7()
         self.created_at = datetime.utcnow()
         self.updated_at = self.created_at
         self.name = name
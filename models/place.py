@@ -1,29 +1,56 @@
-import uuid
 from datetime import datetime
+from sqlalchemy import bindparam
 from app import db
+from app.ids import BinaryUUID, uuid7
+from app.soft_delete import SoftDelete
+from app.geo import encode_geohash
 
-class Place(db.Model):
+"""Which amenities each place has; places.amenity_mask mirrors it for the amenities that have a bit"""
+place_amenities = db.Table(
+    'place_amenities',
+    db.Column('place_id', BinaryUUID, db.ForeignKey('places.id'), primary_key=True),
+    db.Column('amenity_id', BinaryUUID, db.ForeignKey('amenities.id'), primary_key=True),
+    db.Column('created_at', db.DateTime, nullable=False, default=datetime.now),
+    db.Index('ix_place_amenities_amenity', 'amenity_id', 'place_id'),
+)
+
+
+class Place(SoftDelete, db.Model):
     __tablename__ = 'places'
+    __table_args__ = (
+        db.Index('ix_places_created_at_id', 'created_at', 'id'),
+        # Search: equality columns first, then the column the results are sorted on
+        db.Index('ix_places_city_price', 'city_id', 'is_deleted', 'price_per_night', 'id'),
+        db.Index('ix_places_city_created', 'city_id', 'is_deleted', 'created_at', 'id'),
+        db.Index('ix_places_city_guests', 'city_id', 'is_deleted', 'max_guests'),
+        db.Index('ix_places_price', 'is_deleted', 'price_per_night', 'id'),
+        db.Index('ix_places_live_created', 'is_deleted', 'created_at', 'id'),
+    )
 
-    id = db.Column(db.String(60), primary_key=True)
-    host_id = db.Column(db.String(60), db.ForeignKey('users.id'), nullable=False)
-    city_id = db.Column(db.String(60), db.ForeignKey('cities.id'), nullable=False)
+    id = db.Column(BinaryUUID, primary_key=True)
+    host_id = db.Column(BinaryUUID, db.ForeignKey('users.id'), nullable=False)
+    city_id = db.Column(BinaryUUID, db.ForeignKey('cities.id'), nullable=False)
     name = db.Column(db.String(128), nullable=False)
     description = db.Column(db.String(1024), nullable=True, default='')
     address = db.Column(db.String(1024), nullable=True, default='')
     latitude = db.Column(db.Float, nullable=True, default=None)
     longitude = db.Column(db.Float, nullable=True, default=None)
+    geohash = db.Column(db.String(12), nullable=True, default=None, index=True)
     number_of_rooms = db.Column(db.Integer, nullable=False)
     number_of_bathrooms = db.Column(db.Integer, nullable=False)
     price_per_night = db.Column(db.Integer, nullable=False)
     max_guests = db.Column(db.Integer, nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
+    review_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    # Bit Amenity.bit is set for each amenity the place has (see place_amenities)
+    amenity_mask = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
     reviews = db.relationship('Review', backref='place', lazy='dynamic')
-    is_deleted = db.Column(db.Boolean, default=False, nullable=False)
+    amenities = db.relationship('Amenity', secondary=place_amenities, lazy='dynamic')
 
     def __init__(self, host_id, city_id, name, number_of_rooms, number_of_bathrooms, price_per_night, max_guests, description='', address='', latitude=None, longitude=None):
-        self.id = str(uuid.uuid4())
+        self.id = uuid7()
         self.host_id = host_id
         self.city_id = city_id
         self.name = name
@@ -31,9 +58,60 @@ class Place(db.Model):
         self.address = address
         self.latitude = latitude
         self.longitude = longitude
+        self.update_geohash()
         self.number_of_rooms = number_of_rooms
         self.number_of_bathrooms = number_of_bathrooms
         self.price_per_night = price_per_night
         self.max_guests = max_guests
+        self.review_count = 0
+        self.rating_sum = 0
+        self.amenity_mask = 0
         self.created_at = datetime.now()
-        self.updated_at = datetime.now()
\ No newline at end of file
+        self.updated_at = datetime.now()
+
+    def update_geohash(self):
+        """Recompute the indexed geohash cell after latitude/longitude change"""
+        if self.latitude is None or self.longitude is None:
+            self.geohash = None
+        else:
+            self.geohash = encode_geohash(self.latitude, self.longitude)
+
+    @property
+    def average_rating(self):
+        if not self.review_count:
+            return None
+        return round(self.rating_sum / self.review_count, 2)
+
+    @classmethod
+    def adjust_rating(cls, place_id, rating, count=1):
+        """Add (or with a negative count, remove) reviews from the stored aggregates.
+
+        This is a single in-database ``UPDATE ... SET review_count = review_count + :n``
+        in the caller's transaction, so concurrent reviews never lose an update.
+        """
+        cls.query.filter_by(id=place_id).update({
+            cls.review_count: cls.review_count + count,
+            cls.rating_sum: cls.rating_sum + rating,
+        }, synchronize_session=False)
+
+    @classmethod
+    def adjust_ratings(cls, totals):
+        """Apply many ``{place_id: (count, rating_sum)}`` adjustments with one executemany"""
+        if not totals:
+            return
+        table = cls.__table__
+        statement = table.update().where(table.c.id == bindparam('place_id')).values(
+            review_count=table.c.review_count + bindparam('delta_count'),
+            rating_sum=table.c.rating_sum + bindparam('delta_sum'))
+        db.session.execute(statement, [
+            {'place_id': place_id, 'delta_count': count, 'delta_sum': rating_sum}
+            for place_id, (count, rating_sum) in totals.items()])
+
+    @classmethod
+    def set_amenity_bit(cls, place_id, bit, present):
+        """Set or clear one amenity bit with an in-database ``UPDATE``, like ``adjust_rating``"""
+        values = {cls.updated_at: datetime.now()}
+        if bit is not None:
+            values[cls.amenity_mask] = cls.amenity_mask.bitwise_or(1 << bit) if present \
+                else cls.amenity_mask.bitwise_and(~(1 << bit))
+        cls.query.filter_by(id=place_id).update(values, synchronize_session=False)
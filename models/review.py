@@ -1,21 +1,26 @@
-import uuid
 from datetime import datetime
 from app import db
+from app.ids import BinaryUUID, uuid7
+from app.soft_delete import SoftDelete
 
-class Review(db.Model):
+class Review(SoftDelete, db.Model):
     __tablename__ = 'reviews'
+    __table_args__ = (
+        db.Index('ix_reviews_created_at_id', 'created_at', 'id'),
+        db.Index('ix_reviews_live_created', 'is_deleted', 'created_at', 'id'),
+        db.Index('ix_reviews_place_live', 'place_id', 'is_deleted', 'created_at', 'id'),
+    )
 
-    id = db.Column(db.String(60), primary_key=True)
-    user_id = db.Column(db.String(60), db.ForeignKey('users.id'), nullable=False)
-    place_id = db.Column(db.String(60), db.ForeignKey('places.id'), nullable=False)
+    id = db.Column(BinaryUUID, primary_key=True)
+    user_id = db.Column(BinaryUUID, db.ForeignKey('users.id'), nullable=False)
+    place_id = db.Column(BinaryUUID, db.ForeignKey('places.id'), nullable=False)
     comment = db.Column(db.String(1024), nullable=False)
     rating = db.Column(db.Float, nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
-    is_deleted = db.Column(db.Boolean, default=False, nullable=False)
 
     def __init__(self, user_id, place_id, comment, rating):
-        self.id = str(uuid.uuid4())
+        self.id = uuid7()
         self.user_id = user_id
         self.place_id = place_id
         self.comment = comment
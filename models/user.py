@@ -1,26 +1,45 @@
-import uuid
 from datetime import datetime
+from sqlalchemy.orm import validates
 from app import db
+from app.ids import BinaryUUID, uuid7
+from app.soft_delete import SoftDelete
 
-class User(db.Model):
+
+def normalize_email(email):
+    """The form emails are compared in: surrounding whitespace dropped, lower case"""
+    return email.strip().lower()
+
+
+class User(SoftDelete, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_created_at_id', 'created_at', 'id'),
+        db.Index('ix_users_live_created', 'is_deleted', 'created_at', 'id'),
+        # One account per address, deleted accounts included (they can be reactivated)
+        db.Index('ux_users_email_normalized', 'email_normalized', unique=True),
+    )
 
-    id = db.Column(db.String(60), primary_key=True)
+    id = db.Column(BinaryUUID, primary_key=True)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
     first_name = db.Column(db.String(20), nullable=False)
     last_name = db.Column(db.String(20), nullable=False)
     email = db.Column(db.String(60), nullable=False)
+    email_normalized = db.Column(db.String(60), nullable=True)
     password = db.Column(db.String(128), nullable=False)
     places = db.relationship('Place', backref='host', lazy='dynamic')
     reviews = db.relationship('Review', backref='user', lazy='dynamic')
-    is_deleted = db.Column(db.Boolean, default=False, nullable=False)
 
     def __init__(self, first_name, last_name, email, password):
-        self.id = str(uuid.uuid4())
+        self.id = uuid7()
         self.created_at = datetime.now()
         self.updated_at = self.created_at
         self.first_name = first_name
         self.last_name = last_name
         self.email = email
-        self.password = password
\ No newline at end of file
+        self.password = password
+
+    @validates('email')
+    def _normalize_email(self, key, email):
+        self.email_normalized = normalize_email(email)
+        return email
@@ -0,0 +1,71 @@
+import os
+import tempfile
+
+# Configuration is read when the app is imported, so point it at a scratch database first
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ.setdefault('BCRYPT_POOL_SIZE', '0')
+os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')
+os.environ.setdefault('SNAPSHOT_POLL_INTERVAL', '0')
+
+import pytest
+
+from app import app, db
+from models.city import City
+from models.country import Country
+from models.place import Place
+from models.review import Review
+from models.user import User
+
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        db.create_all()
+    yield app.test_client()
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+class Factory(object):
+    """Rows for a test, each added and committed in its own app context; the methods return ids"""
+
+    def __init__(self):
+        self.users = 0
+        self.countries = {}
+
+    def country(self, code='FR'):
+        if code not in self.countries:
+            self.countries[code] = self._add(Country('Country ' + code, code))
+        return self.countries[code]
+
+    def city(self, name='Paris', code='FR'):
+        return self._add(City(name, self.country(code)))
+
+    def user(self, email=None):
+        self.users += 1
+        return self._add(User('a', 'b', email or 'user%d@example.com' % self.users, 'x'))
+
+    def place(self, host_id, city_id, **kwargs):
+        return self._add(Place(host_id, city_id, 'p', 1, 1, 10, 2, **kwargs))
+
+    def review(self, user_id, place_id, rating=4):
+        """A review counted in its place's aggregates, as the API saves it"""
+        with app.app_context():
+            review = Review(user_id, place_id, 'nice', rating)
+            db.session.add(review)
+            Place.adjust_rating(place_id, rating)
+            db.session.commit()
+            return review.id
+
+    def _add(self, row):
+        with app.app_context():
+            row_id = row.id
+            db.session.add(row)
+            db.session.commit()
+            return row_id
+
+
+@pytest.fixture
+def factory(client):
+    return Factory()
@@ -0,0 +1,16 @@
+from app import app
+from models.place import Place
+
+
+def test_bulk_places_accept_non_canonical_ids(client, factory):
+    host_id, city_id = factory.user(), factory.city()
+    items = [{'host_id': host, 'city_id': city, 'name': 'p', 'number_of_rooms': 1, 'number_of_bathrooms': 1,
+              'price_per_night': 10, 'max_guests': 2}
+             for host, city in ((host_id, city_id), (host_id.upper(), '{%s}' % city_id),
+                                ('not-an-id', city_id))]
+
+    response = client.post('/api/v1/place/bulk', json=items)
+    assert response.status_code == 207, response.data
+    assert [result['status'] for result in response.get_json()['results']] == [201, 201, 404]
+    with app.app_context():
+        assert {place.host_id for place in Place.query.all()} == {host_id}
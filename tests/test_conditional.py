@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from sqlalchemy import update
+
+from app import app, db
+from models.amenity import Amenity
+
+
+def test_page_changes_when_a_row_inside_it_is_deleted(client):
+    with app.app_context():
+        amenities = [Amenity('amenity %d' % i) for i in range(4)]
+        for amenity in amenities:
+            db.session.add(amenity)
+            db.session.flush()
+        # One updated_at for every row, so only which rows are in the page tells the two pages apart
+        db.session.execute(update(Amenity).values(updated_at=datetime(2030, 1, 1)))
+        db.session.commit()
+        ids = [amenity.id for amenity in amenities]
+
+    first = client.get('/api/v1/amenity', query_string={'limit': 2})
+    assert [amenity['id'] for amenity in first.get_json()['results']] == ids[:2]
+    etag = first.headers['ETag']
+    assert client.get('/api/v1/amenity', query_string={'limit': 2}, headers={'If-None-Match': etag}).status_code == 304
+
+    with app.app_context():
+        db.session.execute(update(Amenity).where(Amenity.id == ids[1]).values(is_deleted=1))
+        db.session.commit()
+
+    second = client.get('/api/v1/amenity', query_string={'limit': 2}, headers={'If-None-Match': etag})
+    assert second.status_code == 200
+    assert [amenity['id'] for amenity in second.get_json()['results']] == [ids[0], ids[2]]
@@ -0,0 +1,16 @@
+import threading
+
+from app import hashing
+from config import Config
+
+
+def test_bulk_hashing_fits_a_queue_smaller_than_the_pool(monkeypatch):
+    monkeypatch.setattr(Config, 'BCRYPT_POOL_SIZE', 4)
+    monkeypatch.setattr(Config, 'BCRYPT_MAX_PENDING', 2)
+    monkeypatch.setattr(Config, 'BCRYPT_QUEUE_TIMEOUT', 0.1)
+    monkeypatch.setattr(hashing, '_pending', threading.BoundedSemaphore(2))
+    try:
+        hashes = hashing.hash_passwords(['p%d' % i for i in range(5)])
+        assert [hashing.check_password(hashed, 'p%d' % i) for i, hashed in enumerate(hashes)] == [True] * 5
+    finally:
+        hashing.shutdown()
@@ -0,0 +1,46 @@
+from sqlalchemy import event
+
+from app import app, db
+
+
+def statements(client, url):
+    """Status of GET ``url`` and the SQL it ran"""
+    seen = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        status = client.get(url).status_code
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return status, seen
+
+
+def seed(factory, count):
+    city_id = factory.city()
+    for _ in range(count):
+        user_id = factory.user()
+        factory.review(user_id, factory.place(user_id, city_id))
+
+
+def test_listings_take_the_same_queries_for_any_page_size(client, factory):
+    seed(factory, 1)
+    few = {url: statements(client, url) for url in ('/api/v1/place', '/api/v1/review')}
+    seed(factory, 4)
+    for url, (status, seen) in few.items():
+        assert status == 200
+        assert len(statements(client, url)[1]) == len(seen)
+
+
+def test_review_listing_selects_no_columns_of_the_place_parents(client, factory):
+    seed(factory, 2)
+    status, seen = statements(client, '/api/v1/review')
+    assert status == 200
+    columns = seen[-1].split('FROM')[0]
+    assert 'users.email' in columns and 'places.name' in columns
+    for column in ('password', 'users_1.', 'cities.', 'countries.'):
+        assert column not in columns
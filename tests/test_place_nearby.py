@@ -0,0 +1,33 @@
+from app import app, db
+from models.user import User
+
+
+def make_places(factory, count):
+    city_id = factory.city()
+    host_ids = [factory.user() for _ in range(count)]
+    place_ids = [factory.place(host_id, city_id, latitude=48.85 + i * 0.001, longitude=2.35)
+                 for i, host_id in enumerate(host_ids)]
+    return place_ids, host_ids
+
+
+def nearby(client):
+    response = client.get('/api/v1/place/nearby', query_string={'lat': 48.85, 'lon': 2.35, 'radius_km': 5})
+    assert response.status_code == 200, response.data
+    return [place['id'] for place in response.get_json()['results']]
+
+
+def test_nearby_skips_places_of_deleted_hosts(client, factory):
+    place_ids, host_ids = make_places(factory, 3)
+    assert nearby(client) == place_ids
+
+    with app.app_context():
+        db.session.get(User, host_ids[0]).is_deleted = 1
+        db.session.commit()
+
+    assert nearby(client) == place_ids[1:]
+
+
+def test_nearby_rejects_out_of_range_limit(client):
+    for limit in ('0', '-1', 'x'):
+        response = client.get('/api/v1/place/nearby', query_string={'lat': 48.85, 'lon': 2.35, 'limit': limit})
+        assert response.status_code == 400
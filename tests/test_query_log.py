@@ -0,0 +1,17 @@
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+
+from app.query_log import _end_query, _fail_query, _start_query
+
+
+def test_failed_statement_leaves_no_start_behind():
+    engine = create_engine('sqlite://')
+    event.listen(engine, 'before_cursor_execute', _start_query)
+    event.listen(engine, 'after_cursor_execute', _end_query)
+    event.listen(engine, 'handle_error', _fail_query)
+    with engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.execute(text('SELECT * FROM missing'))
+        conn.execute(text('SELECT 1'))
+        assert conn.info['query_started'] == []
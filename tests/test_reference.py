@@ -0,0 +1,48 @@
+from app.reference import reference_index
+
+
+def make_country(factory, code):
+    country_id = factory.country(code)
+    # Countries have no write endpoint, so nothing tells the snapshot about this one
+    reference_index.rebuild()
+    return country_id
+
+
+def city_names(client, code):
+    response = client.get('/api/v1/countries/%s/cities' % code)
+    return [city['name'] for city in response.get_json()] if response.status_code == 200 else []
+
+
+def test_city_writes_are_read_back_without_a_reload(client, factory):
+    country_id = make_country(factory, 'FR')
+    rebuilds = reference_index.rebuilds
+
+    response = client.post('/api/v1/city/', json={'name': 'Paris', 'country_id': country_id})
+    assert response.status_code == 201
+    city_id = response.get_json()['id']
+    assert city_names(client, 'FR') == ['Paris']
+
+    assert client.put('/api/v1/city/' + city_id, json={'name': 'Lyon'}).status_code == 200
+    assert city_names(client, 'FR') == ['Lyon']
+
+    assert client.delete('/api/v1/city/' + city_id).status_code == 200
+    assert city_names(client, 'FR') == []
+    # The request threads patched the snapshot; any reload happened on the poller thread
+    assert reference_index.patches >= 3
+    assert reference_index.rebuilds - rebuilds <= 3
+
+
+def test_country_by_code_comes_from_the_snapshot(client, factory):
+    country_id = make_country(factory, 'DE')
+    response = client.get('/api/v1/countries/DE')
+    assert response.status_code == 200
+    assert response.get_json()['id'] == country_id
+    assert client.get('/api/v1/countries/XX').status_code == 400
+
+
+def test_city_deleted_by_a_non_canonical_id_leaves_the_snapshot(client, factory):
+    country_id = make_country(factory, 'FR')
+    city_id = client.post('/api/v1/city/', json={'name': 'Paris', 'country_id': country_id}).get_json()['id']
+
+    assert client.delete('/api/v1/city/' + city_id.upper()).status_code == 200
+    assert city_names(client, 'FR') == []
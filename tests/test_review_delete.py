@@ -0,0 +1,46 @@
+from sqlalchemy import event
+
+from app import app, db
+from models.place import Place
+
+
+def make_review(factory):
+    user_id = factory.user()
+    place_id = factory.place(user_id, factory.city())
+    return place_id, factory.review(user_id, place_id)
+
+
+def aggregates(place_id):
+    with app.app_context():
+        place = db.session.get(Place, place_id)
+        return place.review_count, place.rating_sum
+
+
+def test_delete_takes_review_out_of_aggregates(client, factory):
+    place_id, review_id = make_review(factory)
+    assert aggregates(place_id) == (1, 4)
+    assert client.delete('/api/v1/review/' + review_id).status_code == 200
+    assert aggregates(place_id) == (0, 0)
+    assert client.delete('/api/v1/review/' + review_id).status_code == 404
+    assert aggregates(place_id) == (0, 0)
+
+
+def test_delete_losing_a_race_leaves_aggregates_alone(client, factory):
+    place_id, review_id = make_review(factory)
+    raced = []
+
+    def concurrent_delete(conn, cursor, statement, parameters, context, executemany):
+        # Another request deletes the review after ours loaded it and before our UPDATE runs
+        if statement.startswith('UPDATE reviews') and not raced:
+            raced.append(True)
+            cursor.execute('UPDATE reviews SET is_deleted = 1')
+            cursor.execute('UPDATE places SET review_count = review_count - 1, rating_sum = rating_sum - 4')
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', concurrent_delete)
+    try:
+        assert client.delete('/api/v1/review/' + review_id).status_code == 404
+    finally:
+        event.remove(engine, 'before_cursor_execute', concurrent_delete)
+    assert aggregates(place_id) == (0, 0)
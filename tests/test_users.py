@@ -0,0 +1,6 @@
+def test_update_by_a_non_canonical_id_keeps_the_users_own_email(client, factory):
+    user_id = factory.user('user@example.com')
+
+    response = client.put('/api/v1/users/' + user_id.upper(),
+                          json={'first_name': 'c', 'last_name': 'd', 'email': 'user@example.com', 'password': 'secret'})
+    assert response.status_code == 200, response.data